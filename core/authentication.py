@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+from store.cache import get_version, user_scope
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that keeps the users it loads in the cache for
+    USER_CACHE_TIMEOUT seconds. Entries are stamped with the user's
+    version, which is bumped whenever the user is saved or deleted, so a
+    deactivated user stops authenticating straight away.
+    """
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            return super().get_user(validated_token)
+
+        version = get_version(user_scope(user_id), timeout=settings.USER_CACHE_TIMEOUT)
+        # With CHECK_REVOKE_TOKEN on, tokens minted before a password change
+        # carry an old hash and so never hit an entry cached for new ones.
+        revoke = validated_token.get(api_settings.REVOKE_TOKEN_CLAIM)
+        key = f'core:user:{user_id}:{version}:{revoke}'
+        user = cache.get(key)
+        if user is None:
+            # Raises for unknown and inactive users, so only active ones
+            # are cached.
+            user = super().get_user(validated_token)
+            cache.set(key, user, timeout=settings.USER_CACHE_TIMEOUT)
+        return user
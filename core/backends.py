@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from store.cache import PERMISSIONS_SCOPE, get_version, user_scope
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend that shares each user's resolved permissions across
+    requests through the cache for USER_CACHE_TIMEOUT seconds. Entries
+    are stamped with the user's version, bumped when their groups or own
+    permissions change, and the global permissions version, bumped when
+    a group's permissions or the permissions themselves change.
+    """
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        if not hasattr(user_obj, '_perm_cache'):
+            key = 'core:permissions:{}:{}:{}'.format(
+                user_obj.pk,
+                get_version(user_scope(user_obj.pk), timeout=settings.USER_CACHE_TIMEOUT),
+                get_version(PERMISSIONS_SCOPE))
+            perms = cache.get(key)
+            if perms is None:
+                perms = super().get_all_permissions(user_obj)
+                cache.set(key, perms, timeout=settings.USER_CACHE_TIMEOUT)
+            user_obj._perm_cache = perms
+        return user_obj._perm_cache
@@ -1,6 +1,8 @@
+from store.customers import CUSTOMER_ID_CLAIM
 from store.models import Customer
 from djoser.serializers import UserSerializer as BaseUserSerializer, UserCreateSerializer as BaseUserCreateSerializer
 from djoser.views import UserViewSet
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer as BaseTokenObtainPairSerializer
 
 class UserCreateSerializer(BaseUserCreateSerializer):
     class Meta(BaseUserCreateSerializer.Meta):
@@ -10,4 +12,18 @@ class UserCreateSerializer(BaseUserCreateSerializer):
 
 class UserSerializer(BaseUserSerializer):
     class Meta(BaseUserSerializer.Meta):
-        fields = ['id', 'username', 'email', 'first_name', 'last_name']
\ No newline at end of file
+        fields = ['id', 'username', 'email', 'first_name', 'last_name']
+
+
+class TokenObtainPairSerializer(BaseTokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        customer_id = Customer.objects \
+            .values_list('id', flat=True) \
+            .filter(user_id=user.id) \
+            .first()
+        # Without the claim, get_customer_id falls back to a query.
+        if customer_id is not None:
+            token[CUSTOMER_ID_CLAIM] = customer_id
+        return token
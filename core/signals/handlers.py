@@ -1,6 +1,39 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
+from store.cache import PERMISSIONS_SCOPE, bump_version, user_scope
 from store.signals import order_created
 
 @receiver(order_created)
 def on_order_created(sender, **kwargs):
-  print(kwargs['order'])
\ No newline at end of file
+  print(kwargs['order'])
+
+
+@receiver([post_save, post_delete], sender=settings.AUTH_USER_MODEL)
+def invalidate_user_cache(sender, instance, **kwargs):
+  bump_version(user_scope(instance.pk), timeout=settings.USER_CACHE_TIMEOUT)
+
+
+@receiver(m2m_changed, sender=get_user_model().groups.through)
+@receiver(m2m_changed, sender=get_user_model().user_permissions.through)
+def invalidate_user_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+  if not action.startswith('post_'):
+    return
+  if not reverse:
+    bump_version(user_scope(instance.pk), timeout=settings.USER_CACHE_TIMEOUT)
+  elif pk_set:
+    bump_version(*[user_scope(pk) for pk in pk_set], timeout=settings.USER_CACHE_TIMEOUT)
+  else:
+    # A group or permission was cleared of all its users; they are gone
+    # from pk_set by now.
+    bump_version(PERMISSIONS_SCOPE)
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+@receiver([post_save, post_delete], sender=Group)
+@receiver([post_save, post_delete], sender=Permission)
+def invalidate_permissions(sender, **kwargs):
+  if kwargs.get('action', 'post_').startswith('post_'):
+    bump_version(PERMISSIONS_SCOPE)
@@ -1,9 +1,9 @@
 from django.contrib import admin, messages
-from django.db.models.aggregates import Count
 from django.db.models.query import QuerySet
 from django.utils.html import format_html, urlencode
 from django.urls import reverse
 from . import models
+from .cache import bump_product_versions
 
 
 class InventoryFilter(admin.SimpleListFilter):
@@ -57,6 +57,8 @@ class ProductAdmin(admin.ModelAdmin):
     @admin.action(description='Clear inventory')
     def clear_inventory(self, request, queryset):
         updated_count = queryset.update(inventory=0)
+        bump_product_versions(
+            *queryset.values_list('collection_id', flat=True).distinct())
         self.message_user(
             request,
             f'{updated_count} products were successfully updated.',
@@ -85,22 +87,17 @@ class CollectionAdmin(admin.ModelAdmin):
             }))
         return format_html('<a href="{}">{} Products</a>', url, collection.products_count)
 
-    def get_queryset(self, request):
-        return super().get_queryset(request).annotate(
-            products_count=Count('products')
-        )
-
 
 @admin.register(models.Customer)
 class CustomerAdmin(admin.ModelAdmin):
     list_display = ['first_name', 'last_name',  'membership', 'orders']
     list_editable = ['membership']
     list_per_page = 10
-    list_select_related = ['user']
+    list_select_related = ['user', 'stats']
     ordering = ['user__first_name', 'user__last_name']
     search_fields = ['first_name__istartswith', 'last_name__istartswith']
 
-    @admin.display(ordering='orders_count')
+    @admin.display(ordering='stats__orders_count')
     def orders(self, customer):
         url = (
             reverse('admin:store_order_changelist')
@@ -108,12 +105,8 @@ class CustomerAdmin(admin.ModelAdmin):
             + urlencode({
                 'customer__id': str(customer.id)
             }))
-        return format_html('<a href="{}">{} Orders</a>', url, customer.orders_count)
-
-    def get_queryset(self, request):
-        return super().get_queryset(request).annotate(
-            orders_count=Count('order')
-        )
+        stats = getattr(customer, 'stats', None)
+        return format_html('<a href="{}">{} Orders</a>', url, stats.orders_count if stats else 0)
 
 
 class OrderItemInline(admin.TabularInline):
@@ -0,0 +1,194 @@
+import hashlib
+import time
+from uuid import UUID
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+
+PRODUCTS_SCOPE = 'products'
+COLLECTIONS_SCOPE = 'collections'
+PROMOTIONS_SCOPE = 'promotions'
+PERMISSIONS_SCOPE = 'permissions'
+
+
+def collection_scope(collection_id):
+    return f'collection:{collection_id}'
+
+
+def reviews_scope(product_id):
+    return f'reviews:{product_id}'
+
+
+def cart_scope(cart_id):
+    # Cart ids arrive both as UUIDs and as strings in any accepted format.
+    return f'cart:{UUID(str(cart_id))}'
+
+
+def user_scope(user_id):
+    return f'user:{user_id}'
+
+
+def _version_key(scope):
+    return f'store:version:{scope}'
+
+
+def _modified_key(scope):
+    return f'store:modified:{scope}'
+
+
+def get_version(scope, timeout=None):
+    key = _version_key(scope)
+    version = cache.get(key)
+    if version is None:
+        # Seed counters from the clock so a counter that was evicted never
+        # restarts at a value older entries were stored under.
+        version = int(time.time() * 1000)
+        if not cache.add(key, version, timeout=timeout):
+            version = cache.get(key, version)
+    return version
+
+
+def get_last_modified(scope):
+    key = _modified_key(scope)
+    modified = cache.get(key)
+    if modified is None:
+        # Unknown means "could have changed just now".
+        modified = int(time.time())
+        if not cache.add(key, modified, timeout=None):
+            modified = cache.get(key, modified)
+    return modified
+
+
+def _bump(scopes, timeout):
+    modified = int(time.time())
+    for scope in scopes:
+        key = _version_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, int(time.time() * 1000), timeout=timeout)
+        cache.set(_modified_key(scope), modified, timeout=timeout)
+
+
+def bump_version(*scopes, timeout=None):
+    """
+    Bumps the version counters of `scopes`. Counters for short-lived scopes
+    such as carts should pass a `timeout` so they don't outlive their data.
+    """
+    scopes = set(scopes)
+    _bump(scopes, timeout)
+    if transaction.get_connection().in_atomic_block:
+        # Readers may repopulate the cache from the old rows until the
+        # transaction commits, so bump again once it has.
+        transaction.on_commit(lambda: _bump(scopes, timeout))
+
+
+def bump_product_versions(*collection_ids):
+    bump_version(
+        PRODUCTS_SCOPE,
+        *[collection_scope(pk) for pk in collection_ids if pk is not None])
+
+
+class VersionedViewMixin:
+    """
+    Ties a view's GET responses to the version counter of its scope, those
+    of the scopes in `cache_dependencies`, and the normalized query params
+    listed in `cache_query_params`.
+    """
+    cache_scope = PRODUCTS_SCOPE
+    cache_dependencies = []
+    cache_query_params = []
+
+    def get_cache_scope(self):
+        return self.cache_scope
+
+    def get_cache_scopes(self):
+        return [self.get_cache_scope(), *self.cache_dependencies]
+
+    def get_cache_version(self):
+        return '-'.join(str(get_version(scope)) for scope in self.get_cache_scopes())
+
+    def get_request_digest(self):
+        query_params = self.request.query_params
+        params = sorted(
+            (name, sorted(query_params.getlist(name)))
+            for name in self.cache_query_params
+            if name in query_params)
+        raw = repr((
+            self.request.build_absolute_uri('/'),
+            self.action,
+            sorted(self.kwargs.items()),
+            params))
+        return hashlib.md5(raw.encode()).hexdigest()
+
+
+class CachedResponseMixin(VersionedViewMixin):
+    """
+    Caches the data of successful list and retrieve responses under a key
+    made of the view's version counter and its normalized query params.
+    """
+    cache_prefix = None
+
+    def get_cache_key(self):
+        version = self.get_cache_version()
+        return f'store:{self.cache_prefix}:{version}:{self.get_request_digest()}'
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        key = self.get_cache_key()
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, settings.PRODUCT_CACHE_TIMEOUT)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+
+class ConditionalGetMixin(VersionedViewMixin):
+    """
+    Answers If-None-Match and If-Modified-Since on list and retrieve from the
+    version counter alone, before any query or serializer runs.
+    """
+    def get_etag(self):
+        raw = repr((
+            self.get_cache_version(),
+            self.get_request_digest(),
+            self.request.META.get('HTTP_ACCEPT'),
+            self.request.query_params.get(api_settings.URL_FORMAT_OVERRIDE)))
+        return quote_etag(hashlib.md5(raw.encode()).hexdigest())
+
+    def get_last_modified(self):
+        return max(get_last_modified(scope) for scope in self.get_cache_scopes())
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        etag = self.get_etag()
+        last_modified = self.get_last_modified()
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            return response
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
@@ -0,0 +1,351 @@
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.db.models import Prefetch
+from django.utils.module_loading import import_string
+from decimal import Decimal
+from .cache import bump_version, cart_scope, get_version
+from .models import Cart, CartItem, Product
+
+
+ADD = 'add'
+UPDATE = 'update'
+REMOVE = 'remove'
+
+
+def bump_cart_version(cart_id):
+    bump_version(cart_scope(cart_id), timeout=settings.CART_CACHE_TIMEOUT)
+
+
+def get_cart_version(cart_id):
+    return get_version(cart_scope(cart_id), timeout=settings.CART_CACHE_TIMEOUT)
+
+
+class DatabaseCartStore:
+    """
+    Reads and writes carts straight through to the Cart and CartItem tables.
+    """
+    def get_cart(self, cart_id, queryset=None):
+        if queryset is None:
+            queryset = Cart.objects \
+                .with_totals() \
+                .prefetch_related(Prefetch('items', queryset=self.items_queryset()))
+        return queryset.filter(pk=cart_id).first()
+
+    def items_queryset(self):
+        return CartItem.objects \
+            .with_total_price() \
+            .select_related('product') \
+            .prefetch_related('product__images')
+
+    def get_items(self, cart_id):
+        return list(self.items_queryset().filter(cart_id=cart_id))
+
+    def get_item(self, cart_id, item_id):
+        return self.items_queryset().filter(cart_id=cart_id, pk=item_id).first()
+
+    def get_summary(self, cart_id):
+        return Cart.objects \
+            .filter(pk=cart_id) \
+            .with_totals() \
+            .values('id', 'items_count', 'total_quantity', 'total_price') \
+            .first()
+
+    def item_ids(self, cart_id):
+        if not Cart.objects.filter(pk=cart_id).exists():
+            return None
+        return set(CartItem.objects.filter(cart_id=cart_id).values_list('id', flat=True))
+
+    def add_item(self, cart_id, product_id, quantity):
+        item = CartItem.objects.add_quantity(cart_id, product_id, quantity)
+        if item is not None:
+            bump_cart_version(cart_id)
+        return item
+
+    def update_item(self, cart_id, item_id, quantity):
+        CartItem.objects \
+            .filter(cart_id=cart_id, pk=item_id) \
+            .update(quantity=quantity)
+        bump_cart_version(cart_id)
+
+    def remove_item(self, cart_id, item_id):
+        CartItem.objects.filter(cart_id=cart_id, pk=item_id).delete()
+        bump_cart_version(cart_id)
+
+    def delete_cart(self, cart_id):
+        Cart.objects.filter(pk=cart_id).delete()
+        bump_cart_version(cart_id)
+
+    def evict(self, cart_ids):
+        """
+        Forgets anything cached for carts whose rows were deleted directly.
+        """
+        for cart_id in cart_ids:
+            bump_cart_version(cart_id)
+
+    def apply(self, cart_id, operations):
+        """
+        Applies a batch of add, update and remove operations in one
+        transaction.
+        """
+        with transaction.atomic():
+            for operation in operations:
+                if operation['op'] == ADD:
+                    self.add_item(cart_id, operation['product_id'], operation['quantity'])
+                elif operation['op'] == UPDATE:
+                    self.update_item(cart_id, operation['id'], operation['quantity'])
+                else:
+                    self.remove_item(cart_id, operation['id'])
+
+    def flush(self, cart_id):
+        pass
+
+
+class CachedCartStore(DatabaseCartStore):
+    """
+    Keeps active carts in the cache and writes quantity changes and removals
+    back to the database in the background.
+
+    A cart's state is one cache entry holding {item_id: [product_id,
+    quantity]} for its items, the ids of items removed since the last flush,
+    and a dirty flag. Writers take a per-cart lock around read-modify-write
+    of the entry. New items are inserted into CartItem immediately so the
+    API can return their real id; everything else waits for `flush`, which
+    runs CART_FLUSH_DELAY seconds after the first unflushed change and
+    before checkout.
+    """
+    lock_timeout = 5
+    lock_wait = 5
+
+    def state_key(self, cart_id):
+        return f'store:cart:{cart_id}'
+
+    def flush_key(self, cart_id):
+        return f'store:cart:{cart_id}:flush'
+
+    @contextmanager
+    def lock(self, cart_id):
+        key = f'store:cart:{cart_id}:lock'
+        deadline = time.monotonic() + self.lock_wait
+        while not cache.add(key, 1, timeout=self.lock_timeout):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'Cart {cart_id} is locked.')
+            time.sleep(0.01)
+        try:
+            yield
+        finally:
+            cache.delete(key)
+
+    def load(self, cart_id):
+        key = self.state_key(cart_id)
+        state = cache.get(key)
+        if state is not None:
+            return state
+        if not Cart.objects.filter(pk=cart_id).exists():
+            return None
+        rows = CartItem.objects \
+            .filter(cart_id=cart_id) \
+            .order_by('id') \
+            .values_list('id', 'product_id', 'quantity')
+        state = {
+            'items': {pk: [product_id, quantity] for pk, product_id, quantity in rows},
+            'removed': {},
+            'dirty': False,
+        }
+        # A writer may have stored newer state since we looked.
+        if not cache.add(key, state, timeout=settings.CART_CACHE_TIMEOUT):
+            state = cache.get(key, state)
+        return state
+
+    def save(self, cart_id, state):
+        state['dirty'] = True
+        cache.set(self.state_key(cart_id), state, timeout=settings.CART_CACHE_TIMEOUT)
+        bump_cart_version(cart_id)
+        self.schedule_flush(cart_id)
+
+    def schedule_flush(self, cart_id):
+        from .tasks import flush_cart
+        delay = settings.CART_FLUSH_DELAY
+        if cache.add(self.flush_key(cart_id), 1, timeout=delay):
+            flush_cart.apply_async((str(cart_id),), countdown=delay)
+
+    def build_items(self, cart_id, items):
+        products = Product.objects \
+            .prefetch_related('images') \
+            .in_bulk({product_id for product_id, quantity in items.values()})
+        return [
+            CartItem(id=pk, cart_id=cart_id, product=products[product_id], quantity=quantity)
+            for pk, (product_id, quantity) in sorted(items.items())
+            if product_id in products
+        ]
+
+    def get_cart(self, cart_id, queryset=None):
+        state = self.load(cart_id)
+        if state is None:
+            return None
+        cart = Cart(id=cart_id)
+        # Hand the serializer cart.items.all() the way prefetch_related would.
+        items = cart.items.all()
+        items._result_cache = self.build_items(cart_id, state['items'])
+        items._prefetch_done = True
+        cart._prefetched_objects_cache = {'items': items}
+        cart.total_price = sum(
+            (item.quantity * item.product.unit_price for item in items._result_cache), Decimal(0))
+        return cart
+
+    def get_summary(self, cart_id):
+        state = self.load(cart_id)
+        if state is None:
+            return None
+        prices = dict(Product.objects
+                      .filter(pk__in={product_id for product_id, _ in state['items'].values()})
+                      .values_list('id', 'unit_price'))
+        items = [(quantity, prices[product_id])
+                 for product_id, quantity in state['items'].values() if product_id in prices]
+        return {
+            'id': cart_id,
+            'items_count': len(items),
+            'total_quantity': sum(quantity for quantity, _ in items),
+            'total_price': sum((quantity * price for quantity, price in items), Decimal(0)),
+        }
+
+    def get_items(self, cart_id):
+        state = self.load(cart_id)
+        if state is None:
+            return []
+        return self.build_items(cart_id, state['items'])
+
+    def get_item(self, cart_id, item_id):
+        state = self.load(cart_id)
+        if state is None or item_id not in state['items']:
+            return None
+        items = self.build_items(cart_id, {item_id: state['items'][item_id]})
+        return items[0] if items else None
+
+    @contextmanager
+    def edit(self, cart_id):
+        """
+        Yields the cart's state under its lock and stores it afterwards,
+        unless the block raised or the cart does not exist.
+        """
+        with self.lock(cart_id):
+            state = self.load(cart_id)
+            yield state
+            if state is not None:
+                self.save(cart_id, state)
+
+    def _add(self, state, cart_id, product_id, quantity):
+        items = state['items']
+        pk = next((pk for pk, (product, _) in items.items() if product == product_id), None)
+        if pk is not None:
+            items[pk][1] = min(items[pk][1] + quantity, CartItem.objects.max_quantity())
+            return pk
+        # Reuse a removed row that has not been deleted yet, which also
+        # keeps clear of the (cart, product) unique constraint.
+        pk = next((pk for pk, product in state['removed'].items() if product == product_id), None)
+        if pk is not None:
+            del state['removed'][pk]
+        else:
+            pk = CartItem.objects.add_quantity(cart_id, product_id, quantity).pk
+        items[pk] = [product_id, quantity]
+        return pk
+
+    def _update(self, state, item_id, quantity):
+        if item_id in state['items']:
+            state['items'][item_id][1] = quantity
+
+    def _remove(self, state, item_id):
+        if item_id in state['items']:
+            product_id, _ = state['items'].pop(item_id)
+            state['removed'][item_id] = product_id
+
+    def item_ids(self, cart_id):
+        state = self.load(cart_id)
+        return None if state is None else set(state['items'])
+
+    def add_item(self, cart_id, product_id, quantity):
+        with self.edit(cart_id) as state:
+            if state is None:
+                return None
+            pk = self._add(state, cart_id, product_id, quantity)
+        return self.get_item(cart_id, pk)
+
+    def update_item(self, cart_id, item_id, quantity):
+        with self.edit(cart_id) as state:
+            if state is not None:
+                self._update(state, item_id, quantity)
+
+    def remove_item(self, cart_id, item_id):
+        with self.edit(cart_id) as state:
+            if state is not None:
+                self._remove(state, item_id)
+
+    def apply(self, cart_id, operations):
+        with transaction.atomic(), self.edit(cart_id) as state:
+            if state is None:
+                return
+            for operation in operations:
+                if operation['op'] == ADD:
+                    self._add(state, cart_id, operation['product_id'], operation['quantity'])
+                elif operation['op'] == UPDATE:
+                    self._update(state, operation['id'], operation['quantity'])
+                else:
+                    self._remove(state, operation['id'])
+
+    def delete_cart(self, cart_id):
+        with self.lock(cart_id):
+            Cart.objects.filter(pk=cart_id).delete()
+            cache.delete_many([self.state_key(cart_id), self.flush_key(cart_id)])
+            bump_cart_version(cart_id)
+
+    def evict(self, cart_ids):
+        cache.delete_many([key for cart_id in cart_ids
+                           for key in (self.state_key(cart_id), self.flush_key(cart_id))])
+        super().evict(cart_ids)
+
+    def flush(self, cart_id):
+        with self.lock(cart_id):
+            state = cache.get(self.state_key(cart_id))
+            cache.delete(self.flush_key(cart_id))
+            if state is None or not state['dirty']:
+                return
+            with transaction.atomic():
+                CartItem.objects.bulk_update(
+                    [CartItem(id=pk, quantity=quantity) for pk, (_, quantity) in state['items'].items()],
+                    ['quantity'])
+                if state['removed']:
+                    CartItem.objects.filter(cart_id=cart_id, pk__in=state['removed']).delete()
+        # Checkout flushes inside its own transaction. If that rolls back,
+        # the rows are back as they were and the cart has to stay dirty.
+        transaction.on_commit(lambda: self.mark_flushed(cart_id, state))
+
+    def mark_flushed(self, cart_id, flushed):
+        with self.lock(cart_id):
+            state = cache.get(self.state_key(cart_id))
+            if state is None:
+                return
+            for pk in flushed['removed']:
+                state['removed'].pop(pk, None)
+            if state['items'] == flushed['items'] and not state['removed']:
+                state['dirty'] = False
+            cache.set(self.state_key(cart_id), state, timeout=settings.CART_CACHE_TIMEOUT)
+
+
+_stores = {}
+
+
+def get_cart_store():
+    path = settings.CART_STORE
+    if path not in _stores:
+        _stores[path] = import_string(path)()
+    return _stores[path]
+
+
+@receiver(setting_changed)
+def reset_cart_stores(sender, setting, **kwargs):
+    if setting == 'CART_STORE':
+        _stores.clear()
@@ -0,0 +1,51 @@
+from django.utils.functional import SimpleLazyObject
+from .models import Customer
+
+
+CUSTOMER_ID_CLAIM = 'customer_id'
+
+
+def get_customer_id(request):
+    """
+    Returns the id of the customer making the request, or None for
+    anonymous requests. Tokens issued by the auth endpoints carry it as a
+    claim; anything else costs one query, once per request.
+    """
+    # DRF's Request authenticates lazily and copies the user and token onto
+    # the HttpRequest it wraps, which is where the result is kept.
+    user = request.user
+    request = getattr(request, '_request', request)
+    if not hasattr(request, '_customer_id'):
+        token = getattr(request, 'auth', None)
+        if token is not None and CUSTOMER_ID_CLAIM in token:
+            request._customer_id = token[CUSTOMER_ID_CLAIM]
+        elif user.is_authenticated:
+            request._customer_id = Customer.objects \
+                .values_list('id', flat=True) \
+                .filter(user_id=user.id) \
+                .first()
+        else:
+            request._customer_id = None
+    return request._customer_id
+
+
+def _get_customer(request):
+    customer_id = get_customer_id(request)
+    if customer_id is None:
+        return None
+    return Customer.objects.get(pk=customer_id)
+
+
+class CustomerMiddleware:
+    """
+    Sets `request.customer` to the caller's Customer, loaded the first
+    time it is used. DRF authenticates inside the view, so the lookup has
+    to wait until then.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.customer = SimpleLazyObject(lambda: _get_customer(request))
+        return self.get_response(request)
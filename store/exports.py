@@ -0,0 +1,111 @@
+import csv
+import json
+from collections import defaultdict
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.renderers import BaseRenderer
+from .models import Product, ProductImage
+from .rows import image_url
+
+
+CSV_COLUMNS = [
+    'id', 'title', 'slug', 'description', 'unit_price', 'inventory', 'last_update',
+    'collection_id', 'collection_title', 'images', 'promotion_ids',
+]
+
+
+def iter_products(chunk_size=1000, request=None):
+    """
+    Yields every product with its collection, image URLs and promotions.
+    Products are read in primary key ranges of `chunk_size`, with one images
+    query and one promotions query per chunk, so memory use stays flat.
+    """
+    last_pk = 0
+    while True:
+        chunk = list(
+            Product.objects
+            .order_by('pk')
+            .filter(pk__gt=last_pk)
+            .values('id', 'title', 'slug', 'description', 'unit_price', 'inventory',
+                    'last_update', 'collection_id', 'collection__title')[:chunk_size])
+        if not chunk:
+            return
+        ids = [row['id'] for row in chunk]
+
+        images = defaultdict(list)
+        image_rows = ProductImage.objects \
+            .filter(product_id__in=ids) \
+            .order_by('id') \
+            .values_list('product_id', 'image')
+        for product_id, name in image_rows:
+            images[product_id].append(image_url(name, request))
+
+        promotions = defaultdict(list)
+        promotion_rows = Product.promotions.through.objects \
+            .filter(product_id__in=ids) \
+            .order_by('promotion_id') \
+            .values_list('product_id', 'promotion_id', 'promotion__description', 'promotion__discount')
+        for product_id, pk, description, discount in promotion_rows:
+            promotions[product_id].append(
+                {'id': pk, 'description': description, 'discount': discount})
+
+        for row in chunk:
+            yield {
+                'id': row['id'],
+                'title': row['title'],
+                'slug': row['slug'],
+                'description': row['description'],
+                'unit_price': row['unit_price'],
+                'inventory': row['inventory'],
+                'last_update': row['last_update'],
+                'collection': {'id': row['collection_id'], 'title': row['collection__title']},
+                'images': images[row['id']],
+                'promotions': promotions[row['id']],
+            }
+        last_pk = ids[-1]
+
+
+def ndjson_lines(products):
+    for product in products:
+        yield json.dumps(product, cls=DjangoJSONEncoder) + '\n'
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def csv_lines(products):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for product in products:
+        yield writer.writerow([
+            product['id'],
+            product['title'],
+            product['slug'],
+            product['description'],
+            product['unit_price'],
+            product['inventory'],
+            product['last_update'].isoformat(),
+            product['collection']['id'],
+            product['collection']['title'],
+            '|'.join(url for url in product['images'] if url),
+            '|'.join(str(promotion['id']) for promotion in product['promotions']),
+        ])
+
+
+EXPORT_FORMATS = {
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+    'csv': (csv_lines, 'text/csv'),
+}
+
+
+class PassthroughRenderer(BaseRenderer):
+    """
+    Lets content negotiation accept any media type for views that return a
+    streaming response instead of data to render.
+    """
+    media_type = '*/*'
+    format = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return data
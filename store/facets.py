@@ -0,0 +1,61 @@
+from django.db.models import Count, Q
+from .models import Product
+
+
+def collection_facet(queryset):
+    rows = queryset \
+        .order_by() \
+        .values('collection_id', 'collection__title') \
+        .annotate(count=Count('id')) \
+        .order_by('collection__title')
+    return [
+        {'id': row['collection_id'], 'title': row['collection__title'], 'count': row['count']}
+        for row in rows
+    ]
+
+
+def price_facet(queryset, bounds):
+    buckets = list(zip(bounds, [*bounds[1:], None]))
+    counts = queryset.order_by().aggregate(**{
+        f'bucket_{index}': Count('id', filter=Q(unit_price__gte=low, **(
+            {'unit_price__lt': high} if high is not None else {})))
+        for index, (low, high) in enumerate(buckets)
+    })
+    return [
+        {'min': low, 'max': high, 'count': counts[f'bucket_{index}']}
+        for index, (low, high) in enumerate(buckets)
+    ]
+
+
+def promotion_facet(queryset):
+    rows = Product.promotions.through.objects \
+        .filter(product_id__in=queryset.order_by().values('pk')) \
+        .values('promotion_id', 'promotion__description') \
+        .annotate(count=Count('product_id')) \
+        .order_by('promotion_id')
+    return [
+        {'id': row['promotion_id'], 'description': row['promotion__description'], 'count': row['count']}
+        for row in rows
+    ]
+
+
+class FacetMixin:
+    """
+    Adds a `facets` block with per-collection, per-price-bucket and
+    per-promotion counts of the filtered products to paginated lists when
+    the client sends ?facets=true. Each facet is one grouped query.
+    """
+    facets_query_param = 'facets'
+    price_buckets = [0, 25, 50, 100, 250, 500]
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if request.query_params.get(self.facets_query_param) in ('1', 'true') \
+                and isinstance(response.data, dict):
+            queryset = self.filter_queryset(self.get_queryset())
+            response.data['facets'] = {
+                'collections': collection_facet(queryset),
+                'prices': price_facet(queryset, self.price_buckets),
+                'promotions': promotion_facet(queryset),
+            }
+        return response
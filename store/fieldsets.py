@@ -0,0 +1,81 @@
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+
+FIELDS_PARAM = 'fields'
+EXPAND_PARAM = 'expand'
+
+
+def requested_fields(request, param=FIELDS_PARAM):
+    """
+    Returns the names listed in ?fields= (or ?expand=) for reads, or None
+    when the client did not ask for a subset.
+    """
+    if request is None or request.method not in SAFE_METHODS:
+        return None
+    value = getattr(request, 'query_params', request.GET).get(param)
+    if not value:
+        return None
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+class DynamicFieldsMixin:
+    """
+    Trims a top-level serializer to ?fields= and swaps the fields listed in
+    ?expand= for the nested serializers built by `expandable_fields`.
+    """
+    expandable_fields = {}
+
+    def is_top_level(self):
+        parent = self.parent
+        return parent is None or (
+            isinstance(parent, serializers.ListSerializer) and parent.parent is None)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None or not self.is_top_level():
+            return fields
+
+        for name in requested_fields(request, EXPAND_PARAM) or ():
+            if name in self.expandable_fields:
+                fields[name] = self.expandable_fields[name]()
+
+        only = requested_fields(request)
+        if only is not None:
+            for name in set(fields) - only:
+                del fields[name]
+        return fields
+
+
+class SparseFieldsetMixin:
+    """
+    Plans a view's queryset from ?fields= and ?expand= so that unrequested
+    fields cost no columns, joins or prefetch queries.
+
+    `sparse_columns` maps serializer fields to the model columns they read,
+    `sparse_prefetches` to the prefetch lookups they need, and
+    `sparse_expansions` maps expandable fields to their select_related path.
+    """
+    sparse_columns = {}
+    sparse_prefetches = {}
+    sparse_expansions = {}
+
+    def plan_queryset(self, queryset):
+        fields = requested_fields(self.request)
+        expand = requested_fields(self.request, EXPAND_PARAM) or set()
+
+        for name, lookups in self.sparse_prefetches.items():
+            if fields is None or name in fields:
+                queryset = queryset.prefetch_related(*lookups)
+
+        related = [path for name, path in self.sparse_expansions.items()
+                   if name in expand and (fields is None or name in fields)]
+        if related:
+            queryset = queryset.select_related(*related)
+
+        if fields is not None:
+            columns = {column for name in fields for column in self.sparse_columns.get(name, [])}
+            columns.update(path.split('__')[0] for path in related)
+            queryset = queryset.only(*columns) if columns else queryset.only('pk')
+        return queryset
@@ -1,10 +1,38 @@
-from django_filters.rest_framework import FilterSet
-from .models import Product
+from django_filters.rest_framework import FilterSet, NumberFilter
+from rest_framework.filters import SearchFilter
+from rest_framework.settings import api_settings
+from .models import Order, Product
+from .search import get_search_backend, tokenize
 
 class ProductFilter(FilterSet):
+  effective_price__gt = NumberFilter(field_name='effective_price', lookup_expr='gt')
+  effective_price__lt = NumberFilter(field_name='effective_price', lookup_expr='lt')
+
   class Meta:
     model = Product
     fields = {
       'collection_id': ['exact'],
       'unit_price': ['gt', 'lt']
-    }
\ No newline at end of file
+    }
+
+
+class OrderFilter(FilterSet):
+  class Meta:
+    model = Order
+    fields = {
+      'payment_status': ['exact'],
+      'placed_at': ['gte', 'lt'],
+      'customer_id': ['exact'],
+    }
+
+
+class ProductSearchFilter(SearchFilter):
+  def filter_queryset(self, request, queryset, view):
+    terms = tokenize(' '.join(self.get_search_terms(request)))
+    if not terms:
+      return queryset
+
+    queryset = get_search_backend().search(queryset, terms)
+    if not request.query_params.get(api_settings.ORDERING_PARAM):
+      queryset = queryset.order_by('-search_rank', 'id')
+    return queryset
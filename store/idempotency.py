@@ -0,0 +1,88 @@
+import hashlib
+import json
+import time
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADERS = ['Location', 'Preference-Applied']
+PENDING = 'pending'
+DONE = 'done'
+
+
+def _cache_key(request, key):
+    raw = repr((request.user.pk, request.method, request.path, key))
+    return f'store:idempotency:{hashlib.md5(raw.encode()).hexdigest()}'
+
+
+def _fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.md5(body.encode()).hexdigest()
+
+
+def _replay(entry, fingerprint):
+    if entry['fingerprint'] != fingerprint:
+        return Response(
+            {'detail': f'{IDEMPOTENCY_HEADER} was already used for a different request.'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    response = Response(entry['data'], status=entry['status'], headers=entry['headers'])
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(handler):
+    """
+    Makes a view method safe to retry with an Idempotency-Key header. The
+    first response for a key is kept for IDEMPOTENCY_TTL seconds and
+    replayed for repeats of the same request by the same user. A repeat
+    that arrives while the first is still running waits up to
+    IDEMPOTENCY_WAIT seconds for its response instead of running again.
+    Server errors are not kept, so the client can retry them.
+    """
+    @wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return handler(self, request, *args, **kwargs)
+        if len(key) > 255:
+            return Response(
+                {'detail': f'{IDEMPOTENCY_HEADER} must be at most 255 characters.'},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        cache_key = _cache_key(request, key)
+        fingerprint = _fingerprint(request)
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT
+        pending = {'state': PENDING, 'fingerprint': fingerprint}
+        while not cache.add(cache_key, pending, timeout=settings.IDEMPOTENCY_LOCK_TIMEOUT):
+            # None when the entry expired in between, or the cache is down.
+            entry = cache.get(cache_key)
+            if entry is not None and entry['state'] == DONE:
+                return _replay(entry, fingerprint)
+            if time.monotonic() > deadline:
+                return Response(
+                    {'detail': f'A request with this {IDEMPOTENCY_HEADER} is still being processed.'},
+                    status=status.HTTP_409_CONFLICT)
+            time.sleep(0.05)
+
+        try:
+            response = handler(self, request, *args, **kwargs)
+        except Exception:
+            cache.delete(cache_key)
+            raise
+        if response.status_code >= 500:
+            cache.delete(cache_key)
+            return response
+
+        cache.set(cache_key, {
+            'state': DONE,
+            'fingerprint': fingerprint,
+            'status': response.status_code,
+            'data': response.data,
+            'headers': {name: response[name] for name in REPLAYED_HEADERS if response.has_header(name)},
+        }, timeout=settings.IDEMPOTENCY_TTL)
+        return response
+    return wrapper
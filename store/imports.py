@@ -0,0 +1,128 @@
+import csv
+import json
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+from .cache import COLLECTIONS_SCOPE, bump_product_versions, bump_version
+from .models import Collection, Product
+from .search import get_search_backend
+
+
+IMPORT_FIELDS = ['title', 'slug', 'description', 'unit_price', 'inventory', 'collection_id']
+
+
+class ProductImportRowSerializer(serializers.ModelSerializer):
+    collection_id = serializers.IntegerField()
+
+    class Meta:
+        model = Product
+        fields = IMPORT_FIELDS
+
+
+def parse_ndjson(lines):
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def parse_csv(lines):
+    yield from csv.DictReader(lines)
+
+
+IMPORT_PARSERS = {
+    'ndjson': parse_ndjson,
+    'csv': parse_csv,
+}
+
+
+class ProductImporter:
+    """
+    Upserts products on slug from an iterable of row dicts. Rows are
+    validated a batch at a time, with one query for the batch's collections,
+    and written with one bulk_create and one bulk_update per batch. Caches
+    are invalidated once per batch rather than once per product.
+    """
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self.created = 0
+        self.updated = 0
+        self.errors = []
+
+    def run(self, rows):
+        batch = []
+        for number, row in enumerate(rows, start=1):
+            batch.append((number, row))
+            if len(batch) == self.batch_size:
+                self.import_batch(batch)
+                batch = []
+        if batch:
+            self.import_batch(batch)
+        return self.report()
+
+    def report(self):
+        return {'created': self.created, 'updated': self.updated, 'errors': self.errors}
+
+    def validate_batch(self, batch):
+        valid = []
+        for number, row in batch:
+            if not isinstance(row, dict):
+                self.errors.append({'row': number, 'errors': {'non_field_errors': ['Invalid row.']}})
+                continue
+            serializer = ProductImportRowSerializer(data=row)
+            if serializer.is_valid():
+                valid.append((number, serializer.validated_data))
+            else:
+                self.errors.append({'row': number, 'errors': serializer.errors})
+
+        collection_ids = set(Collection.objects
+                             .filter(pk__in={data['collection_id'] for number, data in valid})
+                             .values_list('id', flat=True))
+        rows = {}
+        for number, data in valid:
+            if data['collection_id'] not in collection_ids:
+                self.errors.append({'row': number, 'errors': {
+                    'collection_id': ['No collection with the given ID was found.']}})
+                continue
+            # A slug repeated within the batch keeps its last row.
+            rows[data['slug']] = data
+        return rows
+
+    def import_batch(self, batch):
+        rows = self.validate_batch(batch)
+        if not rows:
+            return
+
+        with transaction.atomic():
+            existing = {}
+            for product in Product.objects.filter(slug__in=rows).order_by('id'):
+                existing.setdefault(product.slug, product)
+
+            now = timezone.now()
+            to_create, to_update = [], []
+            collection_ids = set()
+            for slug, data in rows.items():
+                product = existing.get(slug)
+                if product is None:
+                    to_create.append(Product(**data))
+                else:
+                    collection_ids.add(product.collection_id)
+                    for name, value in data.items():
+                        setattr(product, name, value)
+                    product.last_update = now
+                    to_update.append(product)
+                collection_ids.add(data['collection_id'])
+
+            Product.objects.bulk_create(to_create, batch_size=self.batch_size)
+            Product.objects.bulk_update(
+                to_update, [*IMPORT_FIELDS, 'last_update'], batch_size=self.batch_size)
+
+            bump_product_versions(*collection_ids)
+            bump_version(COLLECTIONS_SCOPE)
+            get_search_backend().index(Product.objects.filter(slug__in=rows))
+
+        self.created += len(to_create)
+        self.updated += len(to_update)
@@ -0,0 +1,84 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection
+from threading import Barrier
+from time import perf_counter
+from store.models import Cart, CartItem, Collection, Customer, Order, OrderItem, OutOfStock, Product
+from store.serializers import CreateOrderSerializer
+
+
+class Command(BaseCommand):
+    help = 'Runs concurrent checkouts against a small stock and checks nothing is oversold'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--checkouts', type=int, default=50)
+        parser.add_argument('--stock', type=int, default=10)
+        parser.add_argument('--quantity', type=int, default=1)
+        parser.add_argument('--workers', type=int, default=10)
+
+    def handle(self, *args, **options):
+        checkouts = options['checkouts']
+        quantity = options['quantity']
+        User = get_user_model()
+
+        # Checkouts run on their own connections, so setup has to commit.
+        collection = Collection.objects.create(title='Checkout benchmark')
+        product = Product.objects.create(
+            title='Scarce product', slug='scarce-product', unit_price=10,
+            inventory=options['stock'], collection=collection)
+        users = [User.objects.create(username=f'bench-checkout-{i}', email=f'bench-checkout-{i}@example.com')
+                 for i in range(checkouts)]
+        carts = [Cart.objects.create() for _ in range(checkouts)]
+        CartItem.objects.bulk_create(
+            CartItem(cart=cart, product=product, quantity=quantity) for cart in carts)
+        barrier = Barrier(min(options['workers'], checkouts))
+
+        def checkout(user, cart):
+            try:
+                barrier.wait(timeout=5)
+            except Exception:
+                pass
+            start = perf_counter()
+            try:
+                serializer = CreateOrderSerializer(data={'cart_id': cart.id}, context={'customer_id': user.customer.id})
+                serializer.is_valid(raise_exception=True)
+                serializer.save()
+                outcome = 'placed'
+            except OutOfStock:
+                outcome = 'out of stock'
+            except DatabaseError:
+                outcome = 'database error'
+            finally:
+                connection.close()
+            return outcome, perf_counter() - start
+
+        try:
+            start = perf_counter()
+            with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                results = list(executor.map(checkout, users, carts))
+            elapsed = perf_counter() - start
+
+            product.refresh_from_db()
+            placed = sum(1 for outcome, _ in results if outcome == 'placed')
+            latencies = sorted(duration for _, duration in results)
+            for outcome in ['placed', 'out of stock', 'database error']:
+                self.stdout.write(f'{outcome:>15}: {sum(1 for o, _ in results if o == outcome)}')
+            self.stdout.write(f'{"inventory left":>15}: {product.inventory}')
+            self.stdout.write(
+                f'{"latency":>15}: p50 {latencies[len(latencies) // 2] * 1000:.1f}ms, '
+                f'max {latencies[-1] * 1000:.1f}ms, {checkouts / elapsed:,.0f} checkouts/sec')
+
+            if product.inventory < 0 or placed * quantity != options['stock'] - product.inventory:
+                self.stderr.write(self.style.ERROR('Inventory does not match the orders placed.'))
+            else:
+                self.stdout.write(self.style.SUCCESS('No overselling.'))
+        finally:
+            orders = Order.objects.filter(customer__user__in=users)
+            OrderItem.objects.filter(order__in=orders).delete()
+            orders.delete()
+            Cart.objects.filter(pk__in=[cart.pk for cart in carts]).delete()
+            Customer.objects.filter(user__in=users).delete()
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+            product.delete()
+            collection.delete()
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+from time import perf_counter
+from store.models import Collection, Product, ProductImage
+from store.rows import ProductRowPlan
+from store.serializers import ProductSerializer
+
+
+class Command(BaseCommand):
+    help = 'Measures product list rendering in rows/sec, serializer vs row plan'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10_000)
+        parser.add_argument('--page-size', type=int, default=10)
+
+    def handle(self, *args, **options):
+        count = options['products']
+        page_size = options['page_size']
+        request = APIRequestFactory().get('/store/products/', SERVER_NAME='localhost')
+
+        with transaction.atomic():
+            collection = Collection.objects.create(title='Benchmark')
+            Product.objects.bulk_create(
+                Product(title=f'Product {i}', slug=f'product-{i}', description='Benchmark product',
+                        unit_price=10 + i % 90, inventory=i % 100, collection=collection)
+                for i in range(count))
+            queryset = Product.objects.filter(collection=collection)
+            ProductImage.objects.bulk_create(
+                ProductImage(product_id=pk, image=f'store/product/images/{pk}.jpg')
+                for pk in queryset.values_list('id', flat=True)[::2])
+
+            ids = list(queryset.values_list('id', flat=True))
+            pages = [ids[i:i + page_size] for i in range(0, len(ids), page_size)]
+
+            def serializer_page(page_ids):
+                page = queryset.prefetch_related('images').filter(pk__in=page_ids)
+                data = ProductSerializer(page, many=True, context={'request': request}).data
+                return JSONRenderer().render(data)
+
+            def row_plan_page(page_ids):
+                plan = ProductRowPlan(request)
+                page = plan.values(queryset).filter(pk__in=page_ids)
+                return JSONRenderer().render(plan.render(page))
+
+            for name, render_page in [('serializer', serializer_page), ('row plan', row_plan_page)]:
+                start = perf_counter()
+                for page_ids in pages:
+                    render_page(page_ids)
+                elapsed = perf_counter() - start
+                self.stdout.write(f'{name:>10}: {count / elapsed:,.0f} rows/sec ({elapsed:.2f}s)')
+
+            transaction.set_rollback(True)
@@ -0,0 +1,28 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from store.exports import EXPORT_FORMATS, iter_products
+
+
+class Command(BaseCommand):
+    help = 'Streams the whole catalog as NDJSON or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', choices=list(EXPORT_FORMATS), default='ndjson')
+        parser.add_argument('--file', help='Write to this file instead of stdout')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        render_lines, content_type = EXPORT_FORMATS[options['output']]
+        lines = render_lines(iter_products(chunk_size=options['chunk_size']))
+
+        if options['file'] is None:
+            for line in lines:
+                sys.stdout.write(line)
+            return
+
+        try:
+            with open(options['file'], 'w', newline='') as file:
+                for line in lines:
+                    file.write(line)
+        except OSError as error:
+            raise CommandError(error)
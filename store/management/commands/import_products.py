@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from store.imports import IMPORT_PARSERS, ProductImporter
+
+
+class Command(BaseCommand):
+    help = 'Upserts products on slug from an NDJSON or CSV file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file')
+        parser.add_argument('--input', choices=list(IMPORT_PARSERS), default='ndjson')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        importer = ProductImporter(batch_size=options['batch_size'])
+        try:
+            with open(options['file'], newline='') as file:
+                report = importer.run(IMPORT_PARSERS[options['input']](file))
+        except OSError as error:
+            raise CommandError(error)
+
+        for error in report['errors']:
+            self.stderr.write(f'Row {error["row"]}: {error["errors"]}')
+        self.stdout.write(self.style.SUCCESS(
+            f'{report["created"]} products created, {report["updated"]} updated, '
+            f'{len(report["errors"])} rows rejected.'))
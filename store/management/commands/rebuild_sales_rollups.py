@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from store.models import CustomerStats
+from store.rollups import ROLLUP_MODELS, rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the daily sales rollups and customer stats from the order tables'
+
+    def handle(self, *args, **options):
+        rebuild()
+        for model in [*ROLLUP_MODELS, CustomerStats]:
+            self.stdout.write(f'{model._meta.verbose_name_plural}: {model.objects.count()} rows')
+        self.stdout.write(self.style.SUCCESS('Sales rollups and customer stats rebuilt.'))
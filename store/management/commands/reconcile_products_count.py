@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from store.cache import COLLECTIONS_SCOPE, bump_product_versions, bump_version
+from store.models import Collection, Product
+
+
+class Command(BaseCommand):
+    help = 'Repairs Collection.products_count where it has drifted from the products table'
+
+    def handle(self, *args, **options):
+        counts = Product.objects \
+            .filter(collection=OuterRef('pk')) \
+            .order_by() \
+            .values('collection') \
+            .annotate(count=Count('id')) \
+            .values('count')
+        drifted = Collection.objects \
+            .annotate(actual=Coalesce(Subquery(counts), 0)) \
+            .exclude(products_count=F('actual'))
+        ids = list(drifted.values_list('id', flat=True))
+
+        if ids:
+            Collection.objects \
+                .filter(pk__in=ids) \
+                .update(products_count=Coalesce(Subquery(counts), 0))
+            bump_product_versions(*ids)
+            bump_version(COLLECTIONS_SCOPE)
+
+        self.stdout.write(self.style.SUCCESS(f'{len(ids)} collections repaired.'))
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:23
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0015_collection_products_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderRequest',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, primary_key=True, serialize=False)),
+                ('cart_id', models.UUIDField()),
+                ('status', models.CharField(choices=[('P', 'Pending'), ('C', 'Placed'), ('F', 'Failed')], default='P', max_length=1)),
+                ('errors', models.JSONField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='store.customer')),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='store.order')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='store_order_status_9600ba_idx')],
+            },
+        ),
+    ]
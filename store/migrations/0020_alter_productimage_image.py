@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:56
+
+import django.core.validators
+import store.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0019_customer_stats'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='productimage',
+            name='image',
+            field=models.ImageField(upload_to='store/product/images', validators=[store.validators.validate_file_size, django.core.validators.FileExtensionValidator(allowed_extensions=['jpg', 'png'])]),
+        ),
+    ]
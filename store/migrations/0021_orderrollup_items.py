@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:05
+
+from collections import defaultdict
+from django.db import migrations, models
+
+
+def populate_items(apps, schema_editor):
+    OrderItem = apps.get_model('store', 'OrderItem')
+    OrderRollup = apps.get_model('store', 'OrderRollup')
+    items = defaultdict(list)
+    rows = OrderItem.objects.values_list('order_id', 'product_id', 'product__collection_id', 'quantity', 'unit_price')
+    for order_id, product_id, collection_id, quantity, unit_price in rows:
+        items[order_id].append([product_id, collection_id, quantity, str(unit_price)])
+    rollups = list(OrderRollup.objects.all())
+    for rollup in rollups:
+        rollup.items = items[rollup.order_id]
+    OrderRollup.objects.bulk_update(rollups, ['items'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0020_alter_productimage_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderrollup',
+            name='items',
+            field=models.JSONField(default=list),
+        ),
+        migrations.RunPython(populate_items, migrations.RunPython.noop),
+    ]
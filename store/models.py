@@ -1,9 +1,14 @@
 from django.contrib import admin
 from django.conf import settings
 from django.core.validators import MinValueValidator, FileExtensionValidator
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models import Case, Count, DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, Greatest, Least, Round
+from django.utils import timezone
+from decimal import Decimal
 from uuid import uuid4
 
+from store.cache import COLLECTIONS_SCOPE, bump_product_versions, bump_version
 from store.validators import validate_file_size
 
 
@@ -16,14 +21,153 @@ class Collection(models.Model):
     title = models.CharField(max_length=255)
     featured_product = models.ForeignKey(
         'Product', on_delete=models.SET_NULL, null=True, related_name='+', blank=True)
+    products_count = models.IntegerField(default=0, editable=False)
 
     def __str__(self) -> str:
         return self.title
 
+    def save(self, *args, **kwargs):
+        # products_count is only ever moved with F() increments; writing
+        # back a stale in-memory value would undo concurrent changes.
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'products_count']
+        super().save(*args, **kwargs)
+
     class Meta:
         ordering = ['title']
 
 
+TAX_RATE = Decimal('1.1')
+
+
+def adjust_products_count(deltas):
+    """
+    Applies {collection_id: delta} to Collection.products_count atomically,
+    in collection order so concurrent writers take row locks in the same
+    order, and invalidates the cached responses that show the counts.
+    """
+    changed = sorted(pk for pk, delta in deltas.items() if pk is not None and delta)
+    for collection_id in changed:
+        Collection.objects \
+            .filter(pk=collection_id) \
+            .update(products_count=F('products_count') + deltas[collection_id])
+    if changed:
+        bump_product_versions(*changed)
+        bump_version(COLLECTIONS_SCOPE)
+
+
+def _merge_counts(deltas, rows, sign):
+    for collection_id, count in rows:
+        deltas[collection_id] = deltas.get(collection_id, 0) + sign * count
+
+
+class OutOfStock(Exception):
+    def __init__(self, failures):
+        super().__init__(failures)
+        self.failures = failures
+
+
+class ProductQuerySet(models.QuerySet):
+    def with_effective_price(self):
+        """
+        Annotates the price after the best of the product's promotions, with
+        `Promotion.discount` read as a percentage off, and that price with
+        tax. Both are computed in SQL for the whole queryset.
+        """
+        best_discount = Subquery(
+            Promotion.objects
+            .filter(product=OuterRef('pk'))
+            .order_by('-discount')
+            .values('discount')[:1])
+        discount = Cast(
+            Least(Greatest(Coalesce(best_discount, 0.0), 0.0), 100.0),
+            DecimalField(max_digits=5, decimal_places=2))
+        price = DecimalField(max_digits=6, decimal_places=2)
+        return self.annotate(
+            effective_price=Round(
+                F('unit_price') * (Value(Decimal(100)) - discount) / Value(Decimal(100)),
+                2, output_field=price),
+        ).annotate(
+            effective_price_with_tax=Round(
+                F('effective_price') * Value(TAX_RATE),
+                2, output_field=price),
+        )
+
+    def _collection_counts(self):
+        return self.order_by() \
+            .values('collection_id') \
+            .annotate(count=Count('id')) \
+            .values_list('collection_id', 'count')
+
+    def reserve(self, quantities):
+        """
+        Takes {product_id: quantity} out of inventory with one conditional
+        UPDATE that only matches products with enough stock. It either
+        reserves every product or, when any is short, none of them and
+        raises OutOfStock listing the short products. A single statement
+        locks the rows in index order, so concurrent checkouts can't
+        deadlock on each other.
+        """
+        if not quantities:
+            return
+        needed = Case(
+            *[When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()],
+            output_field=models.IntegerField())
+        try:
+            with transaction.atomic(using=self.db):
+                updated = self \
+                    .filter(pk__in=quantities, inventory__gte=needed) \
+                    .update(inventory=F('inventory') - needed)
+                if updated != len(quantities):
+                    # Roll back the products that did have enough stock.
+                    raise OutOfStock([])
+        except OutOfStock:
+            available = dict(self.filter(pk__in=quantities).values_list('id', 'inventory'))
+            raise OutOfStock([
+                {'product_id': pk, 'requested': quantity, 'available': available.get(pk, 0)}
+                for pk, quantity in sorted(quantities.items())
+                if available.get(pk, 0) < quantity
+            ])
+
+    def update(self, **kwargs):
+        if 'collection' not in kwargs and 'collection_id' not in kwargs:
+            return super().update(**kwargs)
+
+        with transaction.atomic(using=self.db):
+            deltas = {}
+            _merge_counts(deltas, self._collection_counts(), -1)
+            ids = list(self.values_list('pk', flat=True))
+            updated = super().update(**kwargs)
+            _merge_counts(deltas, self.model.objects.filter(pk__in=ids)._collection_counts(), 1)
+            adjust_products_count(deltas)
+        return updated
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        with transaction.atomic(using=self.db):
+            created = super().bulk_create(objs, *args, **kwargs)
+            deltas = {}
+            _merge_counts(deltas, [(obj.collection_id, 1) for obj in objs], 1)
+            adjust_products_count(deltas)
+        return created
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        if 'collection' not in fields and 'collection_id' not in fields:
+            return super().bulk_update(objs, fields, *args, **kwargs)
+
+        with transaction.atomic(using=self.db):
+            deltas = {}
+            previous = self.model.objects.filter(pk__in=[obj.pk for obj in objs])
+            _merge_counts(deltas, previous._collection_counts(), -1)
+            updated = super().bulk_update(objs, fields, *args, **kwargs)
+            _merge_counts(deltas, [(obj.collection_id, 1) for obj in objs], 1)
+            adjust_products_count(deltas)
+        return updated
+
+
 class Product(models.Model):
     title = models.CharField(max_length=255)
     slug = models.SlugField()
@@ -38,6 +182,8 @@ class Product(models.Model):
         Collection, on_delete=models.PROTECT, related_name='products')
     promotions = models.ManyToManyField(Promotion, blank=True)
 
+    objects = ProductQuerySet.as_manager()
+
     def __str__(self) -> str:
         return self.title
 
@@ -108,6 +254,120 @@ class Order(models.Model):
         ]
 
 
+class OrderRequest(models.Model):
+    STATUS_PENDING = 'P'
+    STATUS_PLACED = 'C'
+    STATUS_FAILED = 'F'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_PLACED, 'Placed'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid4)
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
+    cart_id = models.UUIDField()
+    status = models.CharField(
+        max_length=1, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True)
+    errors = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'created_at'])]
+
+
+class OrderRollup(models.Model):
+    """
+    Records what an order currently contributes to the sales rollups, so
+    re-applying it is a no-op and a payment status change can be moved
+    from the old status to the new one.
+    """
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, primary_key=True)
+    payment_status = models.CharField(max_length=1, choices=Order.PAYMENT_STATUS_CHOICES)
+    membership = models.CharField(max_length=1, choices=Customer.MEMBERSHIP_CHOICES)
+    # The [product_id, collection_id, quantity, unit_price] item rows that
+    # were counted, so a deleted order can be taken out after its items.
+    items = models.JSONField(default=list)
+
+
+class DailyProductSales(models.Model):
+    day = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    payment_status = models.CharField(max_length=1, choices=Order.PAYMENT_STATUS_CHOICES)
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = [['day', 'product', 'payment_status']]
+
+
+class DailyCollectionSales(models.Model):
+    day = models.DateField()
+    collection = models.ForeignKey(Collection, on_delete=models.CASCADE)
+    payment_status = models.CharField(max_length=1, choices=Order.PAYMENT_STATUS_CHOICES)
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = [['day', 'collection', 'payment_status']]
+
+
+class DailyMembershipSales(models.Model):
+    day = models.DateField()
+    membership = models.CharField(max_length=1, choices=Customer.MEMBERSHIP_CHOICES)
+    payment_status = models.CharField(max_length=1, choices=Order.PAYMENT_STATUS_CHOICES)
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = [['day', 'membership', 'payment_status']]
+
+
+class CustomerStats(models.Model):
+    """
+    What support needs to know about a customer's orders, kept up to date
+    from the order events instead of being computed from the orders.
+    """
+    customer = models.OneToOneField(
+        Customer, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    orders_count = models.PositiveIntegerField(default=0)
+    lifetime_spend = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    last_order_at = models.DateTimeField(null=True, blank=True)
+    favourite_collection = models.ForeignKey(
+        Collection, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+
+class CustomerCollectionStats(models.Model):
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
+    collection = models.ForeignKey(Collection, on_delete=models.CASCADE)
+    units = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = [['customer', 'collection']]
+
+
+class OutboxEvent(models.Model):
+    """
+    A domain event written in the same transaction as the change it
+    describes and delivered to its receivers afterwards by a worker.
+    """
+    name = models.CharField(max_length=255)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    dispatched_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['dispatched_at', 'available_at'])]
+
+
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.PROTECT, related_name='items')
     product = models.ForeignKey(
@@ -123,10 +383,86 @@ class Address(models.Model):
         Customer, on_delete=models.CASCADE)
 
 
+class CartQuerySet(models.QuerySet):
+    def with_totals(self):
+        """
+        Annotates each cart's number of items, total quantity and total
+        price, aggregated in SQL.
+        """
+        return self.annotate(
+            items_count=Count('items'),
+            total_quantity=Coalesce(Sum('items__quantity'), 0),
+            total_price=Coalesce(
+                Sum(F('items__quantity') * F('items__product__unit_price')),
+                Value(Decimal(0)),
+                output_field=DecimalField(max_digits=12, decimal_places=2)))
+
+
 class Cart(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid4)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = CartQuerySet.as_manager()
+
+
+class CartItemQuerySet(models.QuerySet):
+    def with_total_price(self):
+        return self.annotate(total_price=ExpressionWrapper(
+            F('quantity') * F('product__unit_price'),
+            output_field=DecimalField(max_digits=12, decimal_places=2)))
+
+    def max_quantity(self):
+        field = self.model._meta.get_field('quantity')
+        return connections[self.db].ops.integer_field_range(field.get_internal_type())[1]
+
+    def add_quantity(self, cart_id, product_id, quantity):
+        """
+        Adds `quantity` of a product to a cart with a single INSERT ... SELECT
+        that increments the existing row on conflict, so concurrent adds
+        neither race nor trip the (cart, product) unique constraint. Selecting
+        from the product table doubles as the product's existence check, and
+        the cart's is part of the WHERE clause. The total is capped at what
+        the quantity column holds. Returns None when there is no such cart
+        and raises Product.DoesNotExist when there is no such product.
+        """
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        cart_table = quote(Cart._meta.db_table)
+        db_cart_id = self.model._meta.get_field('cart').get_db_prep_value(cart_id, connection)
+        insert = (
+            f'INSERT INTO {table} (cart_id, product_id, quantity) '
+            f'SELECT %s, id, %s FROM {quote(Product._meta.db_table)} WHERE id = %s '
+            f'AND EXISTS (SELECT 1 FROM {cart_table} WHERE id = %s)')
+        max_quantity = self.max_quantity()
+        params = [db_cart_id, quantity, product_id, db_cart_id, quantity, max_quantity, max_quantity, quantity]
+
+        def total(column):
+            return f'CASE WHEN {column} + %s > %s THEN %s ELSE {column} + %s END'
+
+        with transaction.atomic(using=self.db), connection.cursor() as cursor:
+            if connection.vendor == 'mysql':
+                # LAST_INSERT_ID(id) reports the updated row's id as well.
+                cursor.execute(
+                    f'{insert} ON DUPLICATE KEY UPDATE '
+                    f'{table}.quantity = {total(f"{table}.quantity")}, '
+                    f'{table}.id = LAST_INSERT_ID({table}.id)', params)
+                row = None
+                if cursor.rowcount:
+                    pk = cursor.lastrowid
+                    row = pk, self.filter(pk=pk).values_list('quantity', flat=True).get()
+            else:
+                cursor.execute(
+                    f'{insert} ON CONFLICT (cart_id, product_id) DO UPDATE '
+                    f'SET quantity = {total("quantity")} RETURNING id, quantity', params)
+                row = cursor.fetchone()
+        if row is None:
+            if not Cart.objects.using(self.db).filter(pk=cart_id).exists():
+                return None
+            raise Product.DoesNotExist
+        pk, quantity = row
+        return self.model(id=pk, cart_id=cart_id, product_id=product_id, quantity=quantity)
+
 
 class CartItem(models.Model):
     cart = models.ForeignKey(
@@ -136,6 +472,8 @@ class CartItem(models.Model):
         validators=[MinValueValidator(1)]
     )
 
+    objects = CartItemQuerySet.as_manager()
+
     class Meta:
         unique_together = [['cart', 'product']]
 
@@ -0,0 +1,43 @@
+from django.db import transaction
+from .cache import bump_product_versions
+from .carts import get_cart_store
+from .models import CartItem, Order, OrderItem, Product
+from .outbox import publish
+
+
+class EmptyCart(Exception):
+    pass
+
+
+def place_order(cart_id, customer_id):
+    """
+    Turns a cart into an order for a customer: reserves the inventory,
+    copies the items at their current prices and deletes the cart. Raises
+    EmptyCart or OutOfStock, in which case nothing is written.
+    """
+    store = get_cart_store()
+    with transaction.atomic():
+        store.flush(cart_id)
+        cart_items = list(CartItem.objects
+                          .select_related('product')
+                          .filter(cart_id=cart_id))
+        if not cart_items:
+            raise EmptyCart
+        Product.objects.reserve({item.product_id: item.quantity for item in cart_items})
+        bump_product_versions(*{item.product.collection_id for item in cart_items})
+
+        order = Order.objects.create(customer_id=customer_id)
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product=item.product,
+                unit_price=item.product.unit_price,
+                quantity=item.quantity
+            ) for item in cart_items
+        ])
+
+        store.delete_cart(cart_id)
+
+        publish('order_created', order_id=order.id)
+
+        return order
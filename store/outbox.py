@@ -0,0 +1,81 @@
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import Order, OutboxEvent
+from .signals import order_created, order_payment_status_changed
+
+
+def _load_order(payload):
+    return {'order': Order.objects.get(pk=payload['order_id'])}
+
+
+# Event name -> (signal, function turning the stored payload into the
+# keyword arguments receivers expect).
+EVENTS = {
+    'order_created': (order_created, _load_order),
+    'order_payment_status_changed': (order_payment_status_changed, _load_order),
+}
+
+
+def publish(name, **payload):
+    """
+    Records an event in the current transaction. It is delivered once the
+    transaction commits, and never if it rolls back.
+    """
+    from .tasks import dispatch_outbox
+    event = OutboxEvent.objects.create(name=name, payload=payload)
+    transaction.on_commit(dispatch_outbox.delay)
+    return event
+
+
+def claim(batch_size):
+    """
+    Leases up to `batch_size` due events to this worker for OUTBOX_LEASE
+    seconds. An event whose worker dies is picked up again once the lease
+    runs out, which makes delivery at-least-once.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        events = list(
+            OutboxEvent.objects
+            .select_for_update(skip_locked=True)
+            .filter(dispatched_at__isnull=True,
+                    available_at__lte=now,
+                    attempts__lt=settings.OUTBOX_MAX_ATTEMPTS)
+            .order_by('id')[:batch_size])
+        for event in events:
+            event.available_at = now + timedelta(seconds=settings.OUTBOX_LEASE)
+        OutboxEvent.objects.bulk_update(events, ['available_at'])
+    return events
+
+
+def deliver(event):
+    signal, load = EVENTS[event.name]
+    for receiver, response in signal.send_robust(OutboxEvent, **load(event.payload)):
+        if isinstance(response, Exception):
+            raise response
+
+
+def dispatch(batch_size=None):
+    """
+    Delivers a batch of due events outside of any transaction. A failed
+    event is retried with exponential backoff until OUTBOX_MAX_ATTEMPTS;
+    every receiver sees it again on retry.
+    """
+    events = claim(batch_size or settings.OUTBOX_BATCH_SIZE)
+    delivered = 0
+    for event in events:
+        try:
+            deliver(event)
+        except Exception as error:
+            event.attempts += 1
+            event.last_error = ''.join(traceback.format_exception(error))
+            event.available_at = timezone.now() + timedelta(seconds=2 ** event.attempts)
+            event.save(update_fields=['attempts', 'last_error', 'available_at'])
+        else:
+            event.dispatched_at = timezone.now()
+            event.save(update_fields=['dispatched_at'])
+            delivered += 1
+    return delivered
@@ -1,4 +1,184 @@
-from rest_framework.pagination import PageNumberPagination
+import hashlib
+import json
+from datetime import datetime
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 class DefaultPagination(PageNumberPagination):
-  page_size = 10
\ No newline at end of file
+  page_size = 10
+
+
+class KeysetPagination(BasePagination):
+  """
+  Seeks from the last row of the previous page using the ordering field with
+  `id` as a tie-breaker, so every page costs the same however deep it is.
+  No COUNT is run unless the client asks for an estimate with ?count=true.
+  """
+  page_size = 10
+  ordering = '-id'
+  tie_breaker = 'id'
+  cursor_query_param = 'cursor'
+  count_query_param = 'count'
+  invalid_cursor_message = 'Invalid cursor'
+
+  def paginate_queryset(self, queryset, request, view=None):
+    self.request = request
+    self.field, self.descending = self.get_ordering(queryset)
+    self.estimated_count = None
+    if request.query_params.get(self.count_query_param) in ('1', 'true'):
+      self.estimated_count = self.get_estimated_count(queryset)
+
+    cursor = self.decode_cursor(request)
+    self.has_cursor = cursor is not None
+    self.reverse = bool(cursor and cursor['r'])
+
+    if queryset._fields:
+      # .values() rows need the position columns for the next cursor.
+      queryset = queryset.values(
+        *dict.fromkeys([*queryset._fields, self.field, self.tie_breaker]))
+
+    descending = self.descending != self.reverse
+    prefix = '-' if descending else ''
+    queryset = queryset.order_by(prefix + self.field, prefix + self.tie_breaker)
+    if cursor is not None:
+      lookup = 'lt' if descending else 'gt'
+      queryset = queryset.filter(
+        Q(**{f'{self.field}__{lookup}': cursor['v']}) |
+        Q(**{self.field: cursor['v'], f'{self.tie_breaker}__{lookup}': cursor['id']}))
+
+    results = list(queryset[:self.page_size + 1])
+    self.has_more = len(results) > self.page_size
+    self.page = results[:self.page_size]
+    if self.reverse:
+      self.page.reverse()
+    return self.page
+
+  def get_ordering(self, queryset):
+    ordering = list(queryset.query.order_by)
+    if not ordering and queryset.query.default_ordering:
+      ordering = list(queryset.model._meta.ordering)
+    field = ordering[0] if ordering and isinstance(ordering[0], str) else self.ordering
+    return field.lstrip('-'), field.startswith('-')
+
+  def get_estimated_count(self, queryset):
+    connection = connections[queryset.db]
+    if not queryset.query.where and connection.vendor == 'mysql':
+      # InnoDB keeps an approximate row count in its table statistics.
+      with connection.cursor() as cursor:
+        cursor.execute(
+          'SELECT TABLE_ROWS FROM information_schema.TABLES '
+          'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s',
+          [queryset.model._meta.db_table])
+        row = cursor.fetchone()
+      if row is not None and row[0] is not None:
+        return row[0]
+
+    sql, params = queryset.order_by().query.sql_with_params()
+    digest = hashlib.md5(repr((sql, params)).encode()).hexdigest()
+    return cache.get_or_set(
+      f'store:count:{digest}', queryset.count, settings.PAGINATION_COUNT_TIMEOUT)
+
+  def get_position(self, row):
+    if isinstance(row, dict):
+      return row[self.field], row[self.tie_breaker]
+    return getattr(row, self.field), getattr(row, self.tie_breaker)
+
+  def encode_cursor(self, row, reverse):
+    value, pk = self.get_position(row)
+    cursor = {'f': self.field, 'v': value, 'id': pk, 'r': int(reverse)}
+    if isinstance(value, datetime):
+      # DjangoJSONEncoder drops microseconds, which would seek past rows.
+      cursor.update(v=value.isoformat(), t='datetime')
+    cursor = json.dumps(cursor, cls=DjangoJSONEncoder)
+    encoded = urlsafe_b64encode(cursor.encode()).decode()
+    url = self.request.build_absolute_uri()
+    return replace_query_param(url, self.cursor_query_param, encoded)
+
+  def decode_cursor(self, request):
+    encoded = request.query_params.get(self.cursor_query_param)
+    if not encoded:
+      return None
+    try:
+      cursor = json.loads(urlsafe_b64decode(encoded.encode()))
+      if cursor['f'] != self.field or 'v' not in cursor or 'id' not in cursor:
+        raise ValueError
+      cursor['r'] = bool(cursor.get('r'))
+      if cursor.get('t') == 'datetime':
+        cursor['v'] = parse_datetime(cursor['v'])
+        if cursor['v'] is None:
+          raise ValueError
+    except (TypeError, ValueError, KeyError):
+      raise NotFound(self.invalid_cursor_message)
+    return cursor
+
+  def get_next_link(self):
+    if not self.page or (not self.has_more and not self.reverse):
+      return None
+    return self.encode_cursor(self.page[-1], reverse=False)
+
+  def get_previous_link(self):
+    if not self.page:
+      return None
+    if self.reverse and not self.has_more:
+      return None
+    if not self.reverse and not self.has_cursor:
+      return None
+    return self.encode_cursor(self.page[0], reverse=True)
+
+  def get_paginated_response(self, data):
+    response = {
+      'next': self.get_next_link(),
+      'previous': self.get_previous_link(),
+      'results': data,
+    }
+    if self.estimated_count is not None:
+      response = {'count': self.estimated_count, **response}
+    return Response(response)
+
+  def get_paginated_response_schema(self, schema):
+    return {
+      'type': 'object',
+      'required': ['results'],
+      'properties': {
+        'count': {'type': 'integer'},
+        'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+        'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+        'results': schema,
+      },
+    }
+
+
+class ProductPagination(BasePagination):
+  """
+  Page numbers by default, keyset pages once the client sends ?cursor=
+  (empty for the first page).
+  """
+  def __init__(self):
+    self.page_numbers = DefaultPagination()
+    self.keyset = KeysetPagination()
+    self.paginator = self.page_numbers
+
+  def paginate_queryset(self, queryset, request, view=None):
+    if self.keyset.cursor_query_param in request.query_params:
+      self.paginator = self.keyset
+    else:
+      self.paginator = self.page_numbers
+    return self.paginator.paginate_queryset(queryset, request, view)
+
+  def get_paginated_response(self, data):
+    return self.paginator.get_paginated_response(data)
+
+  def get_paginated_response_schema(self, schema):
+    return self.page_numbers.get_paginated_response_schema(schema)
+
+  def get_results(self, data):
+    return data['results']
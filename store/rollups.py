@@ -0,0 +1,272 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .models import (
+    CustomerCollectionStats, CustomerStats, DailyCollectionSales, DailyMembershipSales, DailyProductSales, Order,
+    OrderItem, OrderRollup)
+
+
+ROLLUP_MODELS = [DailyProductSales, DailyCollectionSales, DailyMembershipSales]
+
+# Grouping -> rollup table. Daily totals come from the membership table
+# since every order lands in exactly one of its rows per day.
+GROUPINGS = {
+    'day': DailyMembershipSales,
+    'product': DailyProductSales,
+    'collection': DailyCollectionSales,
+    'membership': DailyMembershipSales,
+}
+
+
+def _increment(model, keys, **amounts):
+    deltas = {field: F(field) + amount for field, amount in amounts.items()}
+    if amounts.get('orders', 0) < 0:
+        model.objects.filter(**keys).update(**deltas)
+        # Drop rows an order left for another status once they are empty.
+        model.objects.filter(**keys, orders=0).delete()
+        return
+    if model.objects.filter(**keys).update(**deltas):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**keys, **amounts)
+    except IntegrityError:
+        # Another worker created the row first.
+        model.objects.filter(**keys).update(**deltas)
+
+
+ITEM_COLUMNS = ['product_id', 'product__collection_id', 'quantity', 'unit_price']
+
+
+def _item_row(product_id, collection_id, quantity, unit_price):
+    # As stored in OrderRollup.items.
+    return [product_id, collection_id, quantity, str(unit_price)]
+
+
+def _items(order):
+    return [_item_row(*row) for row in OrderItem.objects.filter(order=order).values_list(*ITEM_COLUMNS)]
+
+
+def _totals(items):
+    """
+    Returns the [units, revenue] of the item rows by product and by
+    collection.
+    """
+    by_product = defaultdict(lambda: [0, Decimal(0)])
+    by_collection = defaultdict(lambda: [0, Decimal(0)])
+    for product_id, collection_id, quantity, unit_price in items:
+        for totals in (by_product[product_id], by_collection[collection_id]):
+            totals[0] += quantity
+            totals[1] += quantity * Decimal(unit_price)
+    return by_product, by_collection
+
+
+def _apply(order, totals, payment_status, membership, sign):
+    by_product, by_collection = totals
+    day = timezone.localdate(order.placed_at)
+    for product_id, (units, revenue) in sorted(by_product.items()):
+        _increment(DailyProductSales, {'day': day, 'product_id': product_id, 'payment_status': payment_status},
+                   orders=sign, units=sign * units, revenue=sign * revenue)
+    for collection_id, (units, revenue) in sorted(by_collection.items()):
+        _increment(DailyCollectionSales, {'day': day, 'collection_id': collection_id, 'payment_status': payment_status},
+                   orders=sign, units=sign * units, revenue=sign * revenue)
+    _increment(DailyMembershipSales, {'day': day, 'membership': membership, 'payment_status': payment_status},
+               orders=sign,
+               units=sign * sum(units for units, _ in by_product.values()),
+               revenue=sign * sum((revenue for _, revenue in by_product.values()), Decimal(0)))
+
+
+def _favourite_collection(customer_id):
+    return CustomerCollectionStats.objects \
+        .filter(customer_id=customer_id) \
+        .order_by('-units', 'collection_id') \
+        .values_list('collection_id', flat=True) \
+        .first()
+
+
+def _apply_customer(order, totals, previous_status):
+    _, by_collection = totals
+    stats, _ = CustomerStats.objects \
+        .select_for_update() \
+        .get_or_create(customer_id=order.customer_id)
+    if previous_status is None:
+        stats.orders_count += 1
+        if stats.last_order_at is None or order.placed_at > stats.last_order_at:
+            stats.last_order_at = order.placed_at
+        for collection_id, (units, _) in sorted(by_collection.items()):
+            _increment(CustomerCollectionStats, {'customer_id': order.customer_id, 'collection_id': collection_id},
+                       units=units)
+        stats.favourite_collection_id = _favourite_collection(order.customer_id)
+
+    spend = sum((revenue for _, revenue in by_collection.values()), Decimal(0))
+    if previous_status == Order.PAYMENT_STATUS_COMPLETE:
+        stats.lifetime_spend -= spend
+    if order.payment_status == Order.PAYMENT_STATUS_COMPLETE:
+        stats.lifetime_spend += spend
+    stats.save()
+
+
+def _remove_customer(order, totals, payment_status):
+    _, by_collection = totals
+    stats = CustomerStats.objects \
+        .select_for_update() \
+        .filter(customer_id=order.customer_id) \
+        .first()
+    if stats is None:
+        return
+    collections = CustomerCollectionStats.objects.filter(customer_id=order.customer_id)
+    stats.orders_count -= 1
+    if stats.orders_count == 0:
+        # Customers who never ordered have no stats rows.
+        collections.delete()
+        stats.delete()
+        return
+
+    for collection_id, (units, _) in sorted(by_collection.items()):
+        collections.filter(collection_id=collection_id).update(units=F('units') - units)
+    collections.filter(units=0).delete()
+    stats.favourite_collection_id = _favourite_collection(order.customer_id)
+    stats.last_order_at = Order.objects \
+        .filter(customer_id=order.customer_id) \
+        .exclude(pk=order.pk) \
+        .aggregate(last_order_at=Max('placed_at'))['last_order_at']
+    if payment_status == Order.PAYMENT_STATUS_COMPLETE:
+        stats.lifetime_spend -= sum((revenue for _, revenue in by_collection.values()), Decimal(0))
+    stats.save()
+
+
+def sync_order(order_id):
+    """
+    Brings the sales rollups and the customer's stats in line with an
+    order's current payment status, taking out what it contributed under
+    its previous status. Safe to run any number of times for the same
+    change. Returns whether anything changed.
+    """
+    with transaction.atomic():
+        order = Order.objects \
+            .select_for_update() \
+            .select_related('customer') \
+            .get(pk=order_id)
+        rollup = OrderRollup.objects.filter(order=order).first()
+        if rollup is not None and rollup.payment_status == order.payment_status:
+            return False
+
+        items = _items(order)
+        totals = _totals(items)
+        if rollup is None:
+            previous_status = None
+            rollup = OrderRollup(order=order, membership=order.customer.membership)
+        else:
+            previous_status = rollup.payment_status
+            _apply(order, totals, previous_status, rollup.membership, -1)
+        _apply(order, totals, order.payment_status, rollup.membership, 1)
+        _apply_customer(order, totals, previous_status)
+        rollup.payment_status = order.payment_status
+        rollup.items = items
+        rollup.save()
+    return True
+
+
+def remove_order(order):
+    """
+    Takes a deleted order out of the sales rollups and its customer's
+    stats, using the items it was counted with since they have to be
+    deleted before it. Returns whether it had been counted.
+    """
+    with transaction.atomic():
+        rollup = OrderRollup.objects \
+            .select_for_update() \
+            .filter(order_id=order.pk) \
+            .first()
+        if rollup is None:
+            return False
+
+        totals = _totals(rollup.items)
+        _apply(order, totals, rollup.payment_status, rollup.membership, -1)
+        _remove_customer(order, totals, rollup.payment_status)
+        rollup.delete()
+    return True
+
+
+def sales(group_by, start, end, payment_status=None):
+    """
+    Sums the rollups between `start` and `end` inclusive, one row per
+    value of `group_by`.
+    """
+    rows = GROUPINGS[group_by].objects.filter(day__range=(start, end))
+    if payment_status is not None:
+        rows = rows.filter(payment_status=payment_status)
+    return rows \
+        .values(group_by) \
+        .annotate(orders=Sum('orders'), units=Sum('units'), revenue=Sum('revenue')) \
+        .order_by(GROUPINGS[group_by]._meta.get_field(group_by).attname)
+
+
+def _daily(dimension):
+    return OrderItem.objects \
+        .values(dimension, day=TruncDate('order__placed_at'), payment_status=F('order__payment_status')) \
+        .annotate(orders=Count('order_id', distinct=True),
+                  units=Sum('quantity'),
+                  revenue=Sum(F('quantity') * F('unit_price'))) \
+        .order_by()
+
+
+def _rebuild_customer_stats():
+    stats = {
+        row['customer_id']: CustomerStats(**row)
+        for row in Order.objects
+        .values('customer_id')
+        .annotate(orders_count=Count('id'), last_order_at=Max('placed_at'))
+        .order_by()
+    }
+    spend = OrderItem.objects \
+        .filter(order__payment_status=Order.PAYMENT_STATUS_COMPLETE) \
+        .values_list('order__customer_id') \
+        .annotate(spend=Sum(F('quantity') * F('unit_price'))) \
+        .order_by()
+    for customer_id, lifetime_spend in spend:
+        stats[customer_id].lifetime_spend = lifetime_spend
+
+    collections = [
+        CustomerCollectionStats(customer_id=customer_id, collection_id=collection_id, units=units)
+        for customer_id, collection_id, units in OrderItem.objects
+        .values_list('order__customer_id', 'product__collection_id')
+        .annotate(units=Sum('quantity'))
+        .order_by()
+    ]
+    # Each customer's favourite sorts last among their rows.
+    for row in sorted(collections, key=lambda row: (row.customer_id, row.units, -row.collection_id)):
+        stats[row.customer_id].favourite_collection_id = row.collection_id
+
+    CustomerCollectionStats.objects.bulk_create(collections)
+    CustomerStats.objects.bulk_create(stats.values())
+
+
+def rebuild():
+    """
+    Recomputes the sales rollups and customer stats from the order tables.
+    Orders are counted under their customer's current membership.
+    """
+    with transaction.atomic():
+        for model in [*ROLLUP_MODELS, CustomerCollectionStats, CustomerStats, OrderRollup]:
+            model.objects.all().delete()
+
+        DailyProductSales.objects.bulk_create(
+            DailyProductSales(**row) for row in _daily('product_id'))
+        DailyCollectionSales.objects.bulk_create(
+            DailyCollectionSales(collection_id=row.pop('product__collection_id'), **row)
+            for row in _daily('product__collection_id'))
+        DailyMembershipSales.objects.bulk_create(
+            DailyMembershipSales(membership=row.pop('order__customer__membership'), **row)
+            for row in _daily('order__customer__membership'))
+        _rebuild_customer_stats()
+        items = defaultdict(list)
+        for order_id, *row in OrderItem.objects.values_list('order_id', *ITEM_COLUMNS):
+            items[order_id].append(_item_row(*row))
+        OrderRollup.objects.bulk_create(
+            OrderRollup(order_id=pk, payment_status=payment_status, membership=membership, items=items[pk])
+            for pk, payment_status, membership in Order.objects
+            .values_list('id', 'payment_status', 'customer__membership'))
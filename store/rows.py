@@ -0,0 +1,121 @@
+from collections import defaultdict
+from operator import itemgetter
+from rest_framework.response import Response
+from .fieldsets import EXPAND_PARAM, requested_fields
+from .models import TAX_RATE, ProductImage
+
+
+def image_url(name, request, storage=ProductImage._meta.get_field('image').storage):
+    if not name:
+        return None
+    url = storage.url(name)
+    if request is not None:
+        return request.build_absolute_uri(url)
+    return url
+
+
+def image_rows(product_ids, request):
+    images = defaultdict(list)
+    if product_ids:
+        rows = ProductImage.objects \
+            .filter(product_id__in=product_ids) \
+            .values_list('product_id', 'id', 'image')
+        for product_id, pk, name in rows:
+            images[product_id].append({'id': pk, 'image': image_url(name, request)})
+    return images
+
+
+class RowPlan:
+    """
+    Renders read-only rows straight from `.values()` dicts, producing the
+    same data as the matching serializer without its per-field machinery.
+
+    `get_fields()` returns the output fields in serializer order, each as
+    the columns it reads and a function of the row. Fields left out of
+    ?fields= are dropped along with their columns.
+    """
+    def __init__(self, request=None):
+        self.request = request
+        self.expand = requested_fields(request, EXPAND_PARAM) or set()
+        fields = self.get_fields()
+        only = requested_fields(request)
+        if only is not None:
+            fields = {name: field for name, field in fields.items() if name in only}
+        self.fields = fields
+
+    def get_fields(self):
+        raise NotImplementedError
+
+    @property
+    def columns(self):
+        columns = dict.fromkeys(
+            column for columns, getter in self.fields.values() for column in columns)
+        return list(columns) or ['id']
+
+    def values(self, queryset):
+        return queryset.prefetch_related(None).values(*self.columns)
+
+    def prepare(self, rows):
+        pass
+
+    def render(self, rows):
+        rows = list(rows)
+        self.prepare(rows)
+        plan = [(name, getter) for name, (columns, getter) in self.fields.items()]
+        return [{name: getter(row) for name, getter in plan} for row in rows]
+
+
+class ProductRowPlan(RowPlan):
+    def get_fields(self):
+        collection = (['collection_id'], itemgetter('collection_id'))
+        if 'collection' in self.expand:
+            collection = (
+                ['collection_id', 'collection__title', 'collection__products_count'],
+                lambda row: {
+                    'id': row['collection_id'],
+                    'title': row['collection__title'],
+                    'products_count': row['collection__products_count'],
+                })
+        return {
+            'id': (['id'], itemgetter('id')),
+            'title': (['title'], itemgetter('title')),
+            'description': (['description'], itemgetter('description')),
+            'slug': (['slug'], itemgetter('slug')),
+            'inventory': (['inventory'], itemgetter('inventory')),
+            'unit_price': (['unit_price'], itemgetter('unit_price')),
+            'price_with_tax': (['unit_price'], lambda row: row['unit_price'] * TAX_RATE),
+            'effective_price': (['effective_price'], itemgetter('effective_price')),
+            'effective_price_with_tax': (['effective_price_with_tax'], itemgetter('effective_price_with_tax')),
+            'collection': collection,
+            'images': (['id'], lambda row: self.images[row['id']]),
+        }
+
+    def prepare(self, rows):
+        self.images = image_rows([row['id'] for row in rows], self.request) \
+            if 'images' in self.fields else {}
+
+
+class CollectionRowPlan(RowPlan):
+    def get_fields(self):
+        return {
+            'id': (['id'], itemgetter('id')),
+            'title': (['title'], itemgetter('title')),
+            'products_count': (['products_count'], itemgetter('products_count')),
+        }
+
+
+class RowPlanListMixin:
+    """
+    Lists through `row_plan_class` instead of the serializer.
+    """
+    row_plan_class = None
+
+    def list(self, request, *args, **kwargs):
+        plan = self.row_plan_class(request)
+        queryset = plan.values(self.filter_queryset(self.get_queryset()))
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(plan.render(page))
+
+        return Response(plan.render(queryset))
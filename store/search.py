@@ -0,0 +1,178 @@
+import math
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connection
+from django.db.models import BooleanField, Case, F, FloatField, Func, Value, When
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from .models import Product
+
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall((text or '').lower())
+
+
+class SearchBackend:
+    """
+    Filters a product queryset down to the products matching every search
+    term (as a prefix) and annotates it with a `search_rank` to order by.
+    """
+    def search(self, queryset, terms):
+        raise NotImplementedError
+
+    def index(self, products):
+        pass
+
+    def remove(self, product_ids):
+        pass
+
+
+class MatchAgainst(Func):
+    def __init__(self, *columns, query, output_field=None):
+        super().__init__(*columns, Value(query), output_field=output_field or FloatField())
+
+    def as_sql(self, compiler, connection, **extra_context):
+        *columns, query = self.source_expressions
+        sql, params = [], []
+        for column in columns:
+            column_sql, column_params = compiler.compile(column)
+            sql.append(column_sql)
+            params.extend(column_params)
+        query_sql, query_params = compiler.compile(query)
+        return (
+            f'MATCH ({", ".join(sql)}) AGAINST ({query_sql} IN BOOLEAN MODE)',
+            [*params, *query_params])
+
+
+class MySQLFullTextSearchBackend(SearchBackend):
+    """
+    Uses the FULLTEXT index on (title, description). MySQL keeps the index
+    up to date itself, so there is nothing to do on save or delete.
+    """
+    def search(self, queryset, terms):
+        query = ' '.join(f'+{term}*' for term in terms)
+        return queryset \
+            .filter(MatchAgainst(F('title'), F('description'), query=query, output_field=BooleanField())) \
+            .annotate(search_rank=MatchAgainst(F('title'), F('description'), query=query))
+
+
+class InvertedIndexSearchBackend(SearchBackend):
+    """
+    An in-process inverted index for tests and development databases. It is
+    built from the products table on first use and kept current from the
+    Product signals of the process that owns it.
+    """
+    title_weight = 2.0
+    description_weight = 1.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = None
+        self._documents = {}
+        self._vocabulary = []
+
+    def _build(self):
+        self._postings = defaultdict(dict)
+        self._documents = {}
+        rows = Product.objects.values_list('id', 'title', 'description').iterator()
+        for pk, title, description in rows:
+            self._add(pk, title, description)
+        self._vocabulary = sorted(self._postings)
+
+    def _add(self, pk, title, description):
+        weights = defaultdict(float)
+        for token in tokenize(title):
+            weights[token] += self.title_weight
+        for token in tokenize(description):
+            weights[token] += self.description_weight
+        for token, weight in weights.items():
+            self._postings[token][pk] = weight
+        self._documents[pk] = list(weights)
+
+    def _discard(self, pk):
+        for token in self._documents.pop(pk, []):
+            postings = self._postings.get(token)
+            if postings is not None:
+                postings.pop(pk, None)
+                if not postings:
+                    del self._postings[token]
+
+    def index(self, products):
+        with self._lock:
+            if self._postings is None:
+                return
+            for product in products:
+                self._discard(product.pk)
+                self._add(product.pk, product.title, product.description)
+            self._vocabulary = sorted(self._postings)
+
+    def remove(self, product_ids):
+        with self._lock:
+            if self._postings is None:
+                return
+            for pk in product_ids:
+                self._discard(pk)
+            self._vocabulary = sorted(self._postings)
+
+    def _score_prefix(self, prefix, document_count):
+        scores = defaultdict(float)
+        start = bisect_left(self._vocabulary, prefix)
+        for token in self._vocabulary[start:]:
+            if not token.startswith(prefix):
+                break
+            postings = self._postings[token]
+            idf = math.log(1 + document_count / len(postings))
+            for pk, weight in postings.items():
+                scores[pk] += weight * idf
+        return scores
+
+    def rank(self, terms):
+        with self._lock:
+            if self._postings is None:
+                self._build()
+            document_count = len(self._documents)
+            ranks = None
+            for term in terms:
+                scores = self._score_prefix(term, document_count)
+                if ranks is None:
+                    ranks = scores
+                else:
+                    ranks = {pk: rank + scores[pk] for pk, rank in ranks.items() if pk in scores}
+            return ranks or {}
+
+    def search(self, queryset, terms):
+        ranks = self.rank(terms)
+        if not ranks:
+            return queryset.none().annotate(search_rank=Value(0.0, output_field=FloatField()))
+        return queryset \
+            .filter(pk__in=ranks) \
+            .annotate(search_rank=Case(
+                *[When(pk=pk, then=Value(rank)) for pk, rank in ranks.items()],
+                output_field=FloatField()))
+
+
+_backends = {}
+
+
+def get_search_backend():
+    path = settings.SEARCH_BACKEND
+    if path is None:
+        path = 'store.search.MySQLFullTextSearchBackend' \
+            if connection.vendor == 'mysql' \
+            else 'store.search.InvertedIndexSearchBackend'
+    if path not in _backends:
+        _backends[path] = import_string(path)()
+    return _backends[path]
+
+
+@receiver(setting_changed)
+def reset_search_backends(sender, setting, **kwargs):
+    if setting == 'SEARCH_BACKEND':
+        _backends.clear()
@@ -1,8 +1,14 @@
-from decimal import Decimal
+from django.contrib.auth import get_user_model
 from django.db import transaction
 from rest_framework import serializers
-from .signals import order_created
-from .models import Cart, CartItem, Customer, Order, OrderItem, Product, Collection, ProductImage, Review
+from rest_framework.exceptions import NotFound
+from .carts import ADD, REMOVE, UPDATE, get_cart_store
+from .fieldsets import DynamicFieldsMixin
+from .orders import place_order
+from .rollups import GROUPINGS
+from .models import TAX_RATE, Cart, CartItem, Customer, CustomerStats, Order, OrderItem, OrderRequest, Product, Collection, ProductImage, Review
+from .rows import image_url
+from .tasks import process_order_requests
 
 
 class CollectionSerializer(serializers.ModelSerializer):
@@ -23,19 +29,27 @@ class ProductImageSerializer(serializers.ModelSerializer):
         return ProductImage.objects.create(product_id=product_id, **validated_data)
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
     class Meta:
         model = Product
         fields = ['id', 'title', 'description', 'slug', 'inventory',
-                  'unit_price', 'price_with_tax', 'collection', 'images']
+                  'unit_price', 'price_with_tax', 'effective_price',
+                  'effective_price_with_tax', 'collection', 'images']
         
+    expandable_fields = {
+        'collection': lambda: CollectionSerializer(read_only=True),
+    }
 
     price_with_tax = serializers.SerializerMethodField(
         method_name='calculate_tax')
+    effective_price = serializers.DecimalField(
+        max_digits=6, decimal_places=2, read_only=True)
+    effective_price_with_tax = serializers.DecimalField(
+        max_digits=6, decimal_places=2, read_only=True)
 
     def calculate_tax(self, product: Product):
-        return product.unit_price * Decimal(1.1)
+        return product.unit_price * TAX_RATE
 
 
 class ReviewSerializer(serializers.ModelSerializer):
@@ -54,12 +68,27 @@ class SimpleProductSerializer(serializers.ModelSerializer):
         model = Product
         fields = ['id', 'title', 'images', 'unit_price']
 
+    def to_representation(self, product):
+        # Nested under every cart and order item, so skip the field machinery.
+        request = self.context.get('request')
+        return {
+            'id': product.id,
+            'title': product.title,
+            'images': [
+                {'id': image.id, 'image': image_url(image.image.name, request)}
+                for image in product.images.all()
+            ],
+            'unit_price': product.unit_price,
+        }
+
 
 class CartItemSerializer(serializers.ModelSerializer):
     product = SimpleProductSerializer()
     total_price = serializers.SerializerMethodField()
 
     def get_total_price(self, cart_item: CartItem):
+        if hasattr(cart_item, 'total_price'):
+            return cart_item.total_price
         return cart_item.quantity * cart_item.product.unit_price
 
     class Meta:
@@ -67,12 +96,15 @@ class CartItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'product', 'quantity', 'total_price']
 
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     id = serializers.UUIDField(read_only=True)
     items = CartItemSerializer(many=True, read_only=True)
     total_price = serializers.SerializerMethodField()
 
     def get_total_price(self, cart):
+        # Annotated by Cart.objects.with_totals() or set by the cart store.
+        if hasattr(cart, 'total_price'):
+            return cart.total_price
         return sum([item.quantity * item.product.unit_price for item in cart.items.all()])
 
     class Meta:
@@ -80,30 +112,29 @@ class CartSerializer(serializers.ModelSerializer):
         fields = ['id', 'items', 'total_price']
 
 
+class CartSummarySerializer(serializers.Serializer):
+    id = serializers.UUIDField()
+    items_count = serializers.IntegerField()
+    total_quantity = serializers.IntegerField()
+    total_price = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+
 class AddCartItemSerializer(serializers.ModelSerializer):
     product_id = serializers.IntegerField()
 
-    def validate_product_id(self, value):
-        if not Product.objects.filter(pk=value).exists():
-            raise serializers.ValidationError(
-                'No product with the given ID was found.')
-        return value
-
     def save(self, **kwargs):
         cart_id = self.context['cart_id']
         product_id = self.validated_data['product_id']
         quantity = self.validated_data['quantity']
 
+        # The upsert checks the product exists as part of the same statement.
         try:
-            cart_item = CartItem.objects.get(
-                cart_id=cart_id, product_id=product_id)
-            cart_item.quantity += quantity
-            cart_item.save()
-            self.instance = cart_item
-        except CartItem.DoesNotExist:
-            self.instance = CartItem.objects.create(
-                cart_id=cart_id, **self.validated_data)
-
+            self.instance = get_cart_store().add_item(cart_id, product_id, quantity)
+        except Product.DoesNotExist:
+            raise serializers.ValidationError(
+                {'product_id': ['No product with the given ID was found.']})
+        if self.instance is None:
+            raise NotFound('No cart with the given ID was found.')
         return self.instance
 
     class Meta:
@@ -112,18 +143,97 @@ class AddCartItemSerializer(serializers.ModelSerializer):
 
 
 class UpdateCartItemSerializer(serializers.ModelSerializer):
+    def update(self, instance, validated_data):
+        instance.quantity = validated_data['quantity']
+        get_cart_store().update_item(instance.cart_id, instance.id, instance.quantity)
+        return instance
+
     class Meta:
         model = CartItem
         fields = ['quantity']
 
 
-class CustomerSerializer(serializers.ModelSerializer):
+class CartOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=[ADD, UPDATE, REMOVE])
+    id = serializers.IntegerField(required=False)
+    product_id = serializers.IntegerField(required=False)
+    quantity = serializers.IntegerField(required=False, min_value=1, max_value=32767)
+
+    def validate(self, data):
+        required = {
+            ADD: ['product_id', 'quantity'],
+            UPDATE: ['id', 'quantity'],
+            REMOVE: ['id'],
+        }[data['op']]
+        missing = {name: ['This field is required.'] for name in required if name not in data}
+        if missing:
+            raise serializers.ValidationError(missing)
+        return data
+
+
+class CartBatchSerializer(serializers.Serializer):
+    operations = CartOperationSerializer(many=True, allow_empty=False)
+
+    def validate_operations(self, operations):
+        item_ids = get_cart_store().item_ids(self.context['cart_id'])
+        if item_ids is None:
+            raise NotFound('No cart with the given ID was found.')
+        product_ids = {operation['product_id'] for operation in operations if operation['op'] == ADD}
+        product_ids &= set(Product.objects.filter(pk__in=product_ids).values_list('id', flat=True))
+
+        errors = []
+        for operation in operations:
+            if operation['op'] == ADD and operation['product_id'] not in product_ids:
+                errors.append({'product_id': ['No product with the given ID was found.']})
+            elif operation['op'] != ADD and operation['id'] not in item_ids:
+                errors.append({'id': ['No cart item with the given ID was found.']})
+            else:
+                errors.append({})
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return operations
+
+    def save(self, **kwargs):
+        get_cart_store().apply(self.context['cart_id'], self.validated_data['operations'])
+
+
+class SalesQuerySerializer(serializers.Serializer):
+    group_by = serializers.ChoiceField(choices=list(GROUPINGS), default='day')
+    start = serializers.DateField()
+    end = serializers.DateField()
+    payment_status = serializers.ChoiceField(choices=Order.PAYMENT_STATUS_CHOICES, required=False)
+
+    def validate(self, data):
+        if data['start'] > data['end']:
+            raise serializers.ValidationError({'end': 'Must not be before start.'})
+        return data
+
+
+class SimpleUserSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = get_user_model()
+        fields = ['id', 'username', 'email', 'first_name', 'last_name']
+
+
+class CustomerSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     user_id = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Customer
         fields = ['id', 'user_id', 'phone', 'birth_date', 'membership']
 
+    expandable_fields = {
+        'user': lambda: SimpleUserSerializer(read_only=True),
+    }
+
+
+class CustomerStatsSerializer(serializers.ModelSerializer):
+    favourite_collection = CollectionSerializer(read_only=True)
+
+    class Meta:
+        model = CustomerStats
+        fields = ['orders_count', 'lifetime_spend', 'last_order_at', 'favourite_collection']
+
 
 class OrderItemSerializer(serializers.ModelSerializer):
     product = SimpleProductSerializer()
@@ -133,13 +243,17 @@ class OrderItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'product', 'unit_price', 'quantity']
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True)
 
     class Meta:
         model = Order
         fields = ['id', 'customer', 'placed_at', 'payment_status', 'items']
 
+    expandable_fields = {
+        'customer': lambda: CustomerSerializer(read_only=True),
+    }
+
 
 class UpdateOrderSerializer(serializers.ModelSerializer):
     class Meta:
@@ -151,36 +265,31 @@ class CreateOrderSerializer(serializers.Serializer):
     cart_id = serializers.UUIDField()
 
     def validate_cart_id(self, cart_id):
-        if not Cart.objects.filter(pk=cart_id).exists():
+        item_ids = get_cart_store().item_ids(cart_id)
+        if item_ids is None:
             raise serializers.ValidationError(
                 'No cart with the given ID was found.')
-        if CartItem.objects.filter(cart_id=cart_id).count() == 0:
+        if not item_ids:
             raise serializers.ValidationError('The cart is empty.')
         return cart_id
 
     def save(self, **kwargs):
-        with transaction.atomic():
-            cart_id = self.validated_data['cart_id']
-
-            customer = Customer.objects.get(
-                user_id=self.context['user_id'])
-            order = Order.objects.create(customer=customer)
-
-            cart_items = CartItem.objects \
-                .select_related('product') \
-                .filter(cart_id=cart_id)
-            order_items = [
-                OrderItem(
-                    order=order,
-                    product=item.product,
-                    unit_price=item.product.unit_price,
-                    quantity=item.quantity
-                ) for item in cart_items
-            ]
-            OrderItem.objects.bulk_create(order_items)
-
-            Cart.objects.filter(pk=cart_id).delete()
-
-            order_created.send_robust(self.__class__, order=order)
-
-            return order
\ No newline at end of file
+        return place_order(self.validated_data['cart_id'], self.context['customer_id'])
+
+    def queue(self):
+        """
+        Records an order request for the workers to place and returns it.
+        """
+        order_request = OrderRequest.objects.create(
+            customer_id=self.context['customer_id'],
+            cart_id=self.validated_data['cart_id'])
+        transaction.on_commit(process_order_requests.delay)
+        return order_request
+
+
+class OrderRequestSerializer(serializers.ModelSerializer):
+    order_id = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = OrderRequest
+        fields = ['id', 'cart_id', 'status', 'order_id', 'errors', 'created_at', 'updated_at']
\ No newline at end of file
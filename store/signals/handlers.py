@@ -1,10 +1,112 @@
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
 from django.dispatch import receiver
-from store.models import Customer
+from store.cache import COLLECTIONS_SCOPE, PROMOTIONS_SCOPE, bump_product_versions, bump_version, reviews_scope
+from store.models import Collection, Customer, Order, Product, ProductImage, Promotion, Review, adjust_products_count
+from store.outbox import publish
+from store.rollups import remove_order, sync_order
+from store.search import get_search_backend
+from store.signals import order_created, order_payment_status_changed
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_customer_for_new_user(sender, **kwargs):
   if kwargs['created']:
     Customer.objects.create(user=kwargs['instance'])
-    
\ No newline at end of file
+
+
+@receiver(pre_save, sender=Product)
+def remember_previous_collection(sender, instance, **kwargs):
+  instance._previous_collection_id = None
+  if instance.pk is not None:
+    instance._previous_collection_id = Product.objects \
+      .filter(pk=instance.pk) \
+      .values_list('collection_id', flat=True) \
+      .first()
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product_cache(sender, instance, **kwargs):
+  bump_product_versions(
+    instance.collection_id,
+    getattr(instance, '_previous_collection_id', None))
+  bump_version(COLLECTIONS_SCOPE)
+
+
+@receiver(post_save, sender=Product)
+def count_saved_product(sender, instance, created, **kwargs):
+  previous_collection_id = getattr(instance, '_previous_collection_id', None)
+  if created:
+    adjust_products_count({instance.collection_id: 1})
+  elif previous_collection_id != instance.collection_id:
+    adjust_products_count({previous_collection_id: -1, instance.collection_id: 1})
+
+
+@receiver(post_delete, sender=Product)
+def count_deleted_product(sender, instance, **kwargs):
+  adjust_products_count({instance.collection_id: -1})
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+  get_search_backend().index([instance])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+  get_search_backend().remove([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=ProductImage)
+def invalidate_product_image_cache(sender, instance, **kwargs):
+  collection_id = Product.objects \
+    .filter(pk=instance.product_id) \
+    .values_list('collection_id', flat=True) \
+    .first()
+  bump_product_versions(collection_id)
+
+
+@receiver([post_save, post_delete], sender=Collection)
+def invalidate_collection_cache(sender, instance, **kwargs):
+  bump_product_versions(instance.pk)
+  bump_version(COLLECTIONS_SCOPE)
+
+
+@receiver([post_save, post_delete], sender=Promotion)
+@receiver(m2m_changed, sender=Product.promotions.through)
+def invalidate_promotion_cache(sender, **kwargs):
+  if kwargs.get('action', 'post_').startswith('post_'):
+    bump_version(PROMOTIONS_SCOPE)
+
+
+@receiver([post_save, post_delete], sender=Review)
+def invalidate_review_cache(sender, instance, **kwargs):
+  bump_version(reviews_scope(instance.product_id))
+
+
+@receiver(pre_save, sender=Order)
+def remember_previous_payment_status(sender, instance, **kwargs):
+  instance._previous_payment_status = None
+  if instance.pk is not None:
+    instance._previous_payment_status = Order.objects \
+      .filter(pk=instance.pk) \
+      .values_list('payment_status', flat=True) \
+      .first()
+
+
+@receiver(post_save, sender=Order)
+def publish_payment_status_change(sender, instance, created, **kwargs):
+  previous_payment_status = getattr(instance, '_previous_payment_status', None)
+  if not created and previous_payment_status != instance.payment_status:
+    publish('order_payment_status_changed', order_id=instance.pk)
+
+
+@receiver([order_created, order_payment_status_changed])
+def update_sales_rollups(sender, order, **kwargs):
+  sync_order(order.pk)
+
+
+@receiver(pre_delete, sender=Order)
+def remove_deleted_order_from_sales_rollups(sender, instance, **kwargs):
+  # Its rollup record is deleted along with it, so this can't wait for
+  # the outbox.
+  remove_order(instance)
@@ -0,0 +1,106 @@
+import logging
+from time import perf_counter
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from . import outbox
+from .carts import get_cart_store
+from .models import Cart, CartItem, OrderRequest, OutOfStock
+from .orders import EmptyCart, place_order
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def flush_cart(cart_id):
+    get_cart_store().flush(cart_id)
+
+
+@shared_task
+def purge_expired_carts(chunk_size=None):
+    """
+    Deletes carts created more than CART_TTL ago, with their items, in
+    primary key ranges of at most `chunk_size` carts. Each range is its own
+    short transaction, after which the carts are evicted from the cart
+    store so a cached copy can't outlive its rows.
+    """
+    chunk_size = chunk_size or settings.CART_PURGE_CHUNK_SIZE
+    expired = Cart.objects.filter(created_at__lt=timezone.now() - settings.CART_TTL).order_by('pk')
+    store = get_cart_store()
+    carts = items = chunks = 0
+    started = perf_counter()
+    last_pk = None
+
+    while True:
+        remaining = expired if last_pk is None else expired.filter(pk__gt=last_pk)
+        cart_ids = list(remaining.values_list('pk', flat=True)[:chunk_size])
+        if not cart_ids:
+            break
+
+        chunk_started = perf_counter()
+        with transaction.atomic():
+            # One DELETE each for the items and the carts, without loading
+            # them through the collector. Nothing else hangs off a cart and
+            # neither model has delete signals.
+            chunk_items = CartItem.objects.filter(cart_id__in=cart_ids)._raw_delete(CartItem.objects.db)
+            chunk_carts = Cart.objects.filter(pk__in=cart_ids)._raw_delete(Cart.objects.db)
+        store.evict(cart_ids)
+        elapsed = perf_counter() - chunk_started
+
+        carts += chunk_carts
+        items += chunk_items
+        chunks += 1
+        last_pk = cart_ids[-1]
+        logger.info('Purged %d carts and %d cart items up to %s in %.3fs',
+                    chunk_carts, chunk_items, last_pk, elapsed)
+
+    result = {'carts': carts, 'items': items, 'chunks': chunks,
+              'seconds': round(perf_counter() - started, 3)}
+    logger.info('Purged %(carts)d expired carts and %(items)d cart items '
+                'in %(chunks)d chunks (%(seconds)ss)', result)
+    return result
+
+
+@shared_task
+def process_order_requests(batch_size=None):
+    """
+    Places up to `batch_size` pending order requests, oldest first, and
+    commits them together. Each order has its own savepoint, so a request
+    that cannot be placed, for whatever reason, only fails itself. Rows
+    are claimed with SKIP LOCKED where supported, so concurrent workers
+    take disjoint batches. Runs from beat as well, in case a queued run
+    never arrives.
+    """
+    batch_size = batch_size or settings.ORDER_REQUEST_BATCH_SIZE
+    with transaction.atomic():
+        order_requests = list(
+            OrderRequest.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=OrderRequest.STATUS_PENDING)
+            .order_by('created_at')[:batch_size])
+        now = timezone.now()
+        for order_request in order_requests:
+            try:
+                order_request.order = place_order(order_request.cart_id, order_request.customer_id)
+                order_request.status = OrderRequest.STATUS_PLACED
+            except OutOfStock as error:
+                order_request.status = OrderRequest.STATUS_FAILED
+                order_request.errors = {'items': [
+                    {**failure, 'detail': 'Not enough items in stock.'} for failure in error.failures]}
+            except EmptyCart:
+                order_request.status = OrderRequest.STATUS_FAILED
+                order_request.errors = {'cart_id': ['The cart is empty or no longer exists.']}
+            except Exception:
+                # Left pending, it would head every batch and fail it forever.
+                logger.exception('Could not place order request %s', order_request.id)
+                order_request.status = OrderRequest.STATUS_FAILED
+                order_request.errors = {'detail': 'The order could not be placed.'}
+            order_request.updated_at = now
+        OrderRequest.objects.bulk_update(order_requests, ['status', 'order', 'errors', 'updated_at'])
+    return len(order_requests)
+
+
+@shared_task
+def dispatch_outbox(batch_size=None):
+    return outbox.dispatch(batch_size)
@@ -1,6 +1,23 @@
+from django.core.cache import cache
 from rest_framework.test import APIClient
 import pytest
 
+@pytest.fixture(autouse=True)
+def locmem_cache(settings):
+    settings.CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+    cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def inverted_index_search(settings):
+    # MySQL only sees committed rows in a FULLTEXT index.
+    settings.SEARCH_BACKEND = 'store.search.InvertedIndexSearchBackend'
+
+
 @pytest.fixture
 def api_client():
     return APIClient()
\ No newline at end of file
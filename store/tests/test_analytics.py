@@ -0,0 +1,157 @@
+from datetime import date
+from decimal import Decimal
+from io import StringIO
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.utils import timezone
+from model_bakery import baker
+from rest_framework import status, test
+from store import tasks
+from store.rollups import sync_order
+from store.models import (
+    Cart, CartItem, Collection, Customer, DailyCollectionSales, DailyMembershipSales, DailyProductSales, Order,
+    OrderItem, Product)
+import pytest
+
+User = get_user_model()
+
+
+def place_order(api_client, user, *lines):
+    api_client.force_authenticate(user=user)
+    cart = baker.make(Cart)
+    for product, quantity in lines:
+        baker.make(CartItem, cart=cart, product=product, quantity=quantity)
+    return api_client.post('/store/orders/', {'cart_id': cart.id}).data['id']
+
+
+def rollup_rows():
+    return {
+        model.__name__: sorted(model.objects.values_list(*columns))
+        for model, columns in [
+            (DailyProductSales, ['day', 'product_id', 'payment_status', 'orders', 'units', 'revenue']),
+            (DailyCollectionSales, ['day', 'collection_id', 'payment_status', 'orders', 'units', 'revenue']),
+            (DailyMembershipSales, ['day', 'membership', 'payment_status', 'orders', 'units', 'revenue']),
+        ]
+    }
+
+
+@pytest.fixture
+def products():
+    collection = baker.make(Collection)
+    return (baker.make(Product, collection=collection, unit_price=Decimal('2.50'), inventory=100),
+            baker.make(Product, collection=collection, unit_price=Decimal('10.00'), inventory=100))
+
+
+@pytest.mark.django_db
+class TestSalesRollups:
+    def test_if_order_event_dispatched_rollups_include_it(self, api_client: test.APIClient, products):
+        cheap, dear = products
+        place_order(api_client, baker.make(User), (cheap, 2), (dear, 1))
+
+        assert not DailyProductSales.objects.exists()
+        tasks.dispatch_outbox()
+
+        today = timezone.localdate()
+        pending = Order.PAYMENT_STATUS_PENDING
+        assert rollup_rows() == {
+            'DailyProductSales': [
+                (today, cheap.id, pending, 1, 2, Decimal('5.00')),
+                (today, dear.id, pending, 1, 1, Decimal('10.00'))],
+            'DailyCollectionSales': [(today, cheap.collection_id, pending, 1, 3, Decimal('15.00'))],
+            'DailyMembershipSales': [(today, Customer.MEMBERSHIP_BRONZE, pending, 1, 3, Decimal('15.00'))],
+        }
+
+    def test_if_event_delivered_twice_order_is_counted_once(self, api_client: test.APIClient, products):
+        order_id = place_order(api_client, baker.make(User), (products[0], 2))
+        tasks.dispatch_outbox()
+
+        assert sync_order(order_id) is False
+
+        assert DailyMembershipSales.objects.get().orders == 1
+
+    def test_if_payment_status_changed_totals_move_to_new_status(self, api_client: test.APIClient, products):
+        order_id = place_order(api_client, baker.make(User), (products[0], 2))
+        api_client.force_authenticate(user=User(is_staff=True))
+        api_client.patch(f'/store/orders/{order_id}/', {'payment_status': Order.PAYMENT_STATUS_COMPLETE})
+
+        tasks.dispatch_outbox()
+
+        rows = DailyMembershipSales.objects.values_list('payment_status', 'orders', 'units').order_by('payment_status')
+        assert list(rows) == [(Order.PAYMENT_STATUS_COMPLETE, 1, 2)]
+
+    def test_if_order_deleted_its_sales_are_taken_out(self, api_client: test.APIClient, products):
+        cheap, dear = products
+        place_order(api_client, baker.make(User), (cheap, 1))
+        order_id = place_order(api_client, baker.make(User), (cheap, 2), (dear, 1))
+        tasks.dispatch_outbox()
+        # Order items are protected, so they have to go first.
+        OrderItem.objects.filter(order_id=order_id).delete()
+        api_client.force_authenticate(user=User(is_staff=True))
+
+        response = api_client.delete(f'/store/orders/{order_id}/')
+
+        assert response.status_code == status.HTTP_204_NO_CONTENT
+        today = timezone.localdate()
+        assert rollup_rows()['DailyProductSales'] == [
+            (today, cheap.id, Order.PAYMENT_STATUS_PENDING, 1, 1, Decimal('2.50'))]
+        incremental = rollup_rows()
+        call_command('rebuild_sales_rollups', stdout=StringIO())
+        assert rollup_rows() == incremental
+
+    def test_if_rebuilt_rollups_match_incremental_ones(self, api_client: test.APIClient, products):
+        cheap, dear = products
+        place_order(api_client, baker.make(User), (cheap, 1), (dear, 2))
+        order_id = place_order(api_client, baker.make(User), (cheap, 3))
+        api_client.force_authenticate(user=User(is_staff=True))
+        api_client.patch(f'/store/orders/{order_id}/', {'payment_status': Order.PAYMENT_STATUS_FAILED})
+        tasks.dispatch_outbox()
+        incremental = rollup_rows()
+
+        call_command('rebuild_sales_rollups', stdout=StringIO())
+
+        assert rollup_rows() == incremental
+
+
+@pytest.mark.django_db
+class TestSalesAnalytics:
+    def test_if_user_is_not_admin_returns_403(self, api_client: test.APIClient):
+        api_client.force_authenticate(user=baker.make(User))
+
+        response = api_client.get('/store/analytics/sales/', {'start': '2026-01-01', 'end': '2026-01-31'})
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    def test_if_grouped_by_product_returns_totals_in_range(self, api_client: test.APIClient, products):
+        cheap, dear = products
+        for day, product, units in [('2026-01-01', cheap, 2), ('2026-01-02', cheap, 3),
+                                    ('2026-01-02', dear, 1), ('2026-02-01', cheap, 7)]:
+            baker.make(DailyProductSales, day=day, product=product, payment_status=Order.PAYMENT_STATUS_COMPLETE,
+                       orders=1, units=units, revenue=units * product.unit_price)
+        api_client.force_authenticate(user=User(is_staff=True))
+
+        response = api_client.get('/store/analytics/sales/', {
+            'group_by': 'product', 'start': '2026-01-01', 'end': '2026-01-31'})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['results'] == [
+            {'product': cheap.id, 'orders': 2, 'units': 5, 'revenue': Decimal('12.50')},
+            {'product': dear.id, 'orders': 1, 'units': 1, 'revenue': Decimal('10.00')},
+        ]
+
+    def test_if_filtered_by_payment_status_other_statuses_are_left_out(self, api_client: test.APIClient):
+        for payment_status in [Order.PAYMENT_STATUS_COMPLETE, Order.PAYMENT_STATUS_FAILED]:
+            baker.make(DailyMembershipSales, day='2026-01-01', membership=Customer.MEMBERSHIP_GOLD,
+                       payment_status=payment_status, orders=1, units=1, revenue=5)
+        api_client.force_authenticate(user=User(is_staff=True))
+
+        response = api_client.get('/store/analytics/sales/', {
+            'start': '2026-01-01', 'end': '2026-01-01', 'payment_status': Order.PAYMENT_STATUS_COMPLETE})
+
+        assert [(row['day'], row['orders']) for row in response.data['results']] == [(date(2026, 1, 1), 1)]
+
+    def test_if_range_is_reversed_returns_400(self, api_client: test.APIClient):
+        api_client.force_authenticate(user=User(is_staff=True))
+
+        response = api_client.get('/store/analytics/sales/', {'start': '2026-02-01', 'end': '2026-01-01'})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
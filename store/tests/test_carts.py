@@ -0,0 +1,340 @@
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from model_bakery import baker
+from rest_framework import status, test
+from store import tasks
+from store.carts import get_cart_store
+from store.models import Cart, CartItem, Product
+import pytest
+
+User = get_user_model()
+
+
+@pytest.fixture(params=['store.carts.DatabaseCartStore', 'store.carts.CachedCartStore'])
+def cart_store(request, settings):
+    settings.CART_STORE = request.param
+    return request.param
+
+
+@pytest.fixture
+def scheduled_flushes(monkeypatch):
+    calls = []
+    monkeypatch.setattr(tasks.flush_cart, 'apply_async',
+                        lambda args, countdown: calls.append(args))
+    return calls
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures('cart_store', 'scheduled_flushes')
+class TestCartItems:
+    def test_if_product_added_twice_quantities_are_merged(self, api_client: test.APIClient):
+        cart = baker.make(Cart)
+        product = baker.make(Product)
+
+        api_client.post(f'/store/carts/{cart.id}/items/', {'product_id': product.id, 'quantity': 2})
+        api_client.post(f'/store/carts/{cart.id}/items/', {'product_id': product.id, 'quantity': 3})
+        response = api_client.get(f'/store/carts/{cart.id}/')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert [item['quantity'] for item in response.data['items']] == [5]
+        assert response.data['total_price'] == 5 * product.unit_price
+
+    def test_if_add_repeated_with_idempotency_key_adds_once(self, api_client: test.APIClient):
+        cart = baker.make(Cart)
+        product = baker.make(Product)
+
+        for _ in range(2):
+            response = api_client.post(f'/store/carts/{cart.id}/items/', {'product_id': product.id, 'quantity': 2},
+                                       HTTP_IDEMPOTENCY_KEY='add-1')
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response['Idempotent-Replayed'] == 'true'
+        assert api_client.get(f'/store/carts/{cart.id}/items/').data[0]['quantity'] == 2
+
+    def test_if_item_updated_returns_new_quantity(self, api_client: test.APIClient):
+        cart = baker.make(Cart)
+        item = baker.make(CartItem, cart=cart, quantity=1)
+
+        api_client.patch(f'/store/carts/{cart.id}/items/{item.id}/', {'quantity': 4})
+        response = api_client.get(f'/store/carts/{cart.id}/items/{item.id}/')
+
+        assert response.data['quantity'] == 4
+
+    def test_if_item_deleted_it_is_not_listed(self, api_client: test.APIClient):
+        cart = baker.make(Cart)
+        item = baker.make(CartItem, cart=cart, quantity=1)
+
+        response = api_client.delete(f'/store/carts/{cart.id}/items/{item.id}/')
+
+        assert response.status_code == status.HTTP_204_NO_CONTENT
+        assert api_client.get(f'/store/carts/{cart.id}/items/').data == []
+
+    def test_if_product_does_not_exist_returns_400(self, api_client: test.APIClient):
+        cart = baker.make(Cart)
+
+        response = api_client.post(f'/store/carts/{cart.id}/items/', {'product_id': 0, 'quantity': 1})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert 'product_id' in response.data
+        assert not CartItem.objects.filter(cart=cart).exists()
+
+    def test_if_quantities_add_up_past_the_column_limit_they_are_capped(self, api_client: test.APIClient):
+        cart = baker.make(Cart)
+        product = baker.make(Product)
+        limit = CartItem.objects.max_quantity()
+
+        for _ in range(2):
+            api_client.post(f'/store/carts/{cart.id}/items/', {'product_id': product.id, 'quantity': limit})
+        get_cart_store().flush(cart.id)
+
+        assert api_client.get(f'/store/carts/{cart.id}/items/').data[0]['quantity'] == limit
+        assert CartItem.objects.get(cart=cart).quantity == limit
+
+    def test_if_item_added_to_missing_cart_returns_404(self, api_client: test.APIClient):
+        response = api_client.post('/store/carts/00000000-0000-0000-0000-000000000000/items/', {
+            'product_id': baker.make(Product).id, 'quantity': 1})
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        assert not CartItem.objects.exists()
+
+    def test_if_cart_does_not_exist_returns_404(self, api_client: test.APIClient):
+        response = api_client.get('/store/carts/00000000-0000-0000-0000-000000000000/')
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_if_item_does_not_exist_returns_404(self, api_client: test.APIClient):
+        cart = baker.make(Cart)
+
+        response = api_client.get(f'/store/carts/{cart.id}/items/0/')
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures('cart_store', 'scheduled_flushes')
+class TestBatchCartItems:
+    def test_if_operations_valid_applies_all_and_returns_cart(self, api_client: test.APIClient):
+        cart = baker.make(Cart)
+        kept, removed = baker.make(CartItem, cart=cart, quantity=1, _quantity=2)
+        product = baker.make(Product)
+
+        response = api_client.post(f'/store/carts/{cart.id}/items/batch/', {'operations': [
+            {'op': 'add', 'product_id': product.id, 'quantity': 2},
+            {'op': 'add', 'product_id': product.id, 'quantity': 1},
+            {'op': 'update', 'id': kept.id, 'quantity': 5},
+            {'op': 'remove', 'id': removed.id},
+        ]}, format='json')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert sorted((item['product']['id'], item['quantity']) for item in response.data['items']) == \
+            sorted([(kept.product_id, 5), (product.id, 3)])
+
+    def test_if_any_operation_invalid_returns_400_and_applies_none(self, api_client: test.APIClient):
+        cart = baker.make(Cart)
+        item = baker.make(CartItem, cart=cart, quantity=1)
+
+        response = api_client.post(f'/store/carts/{cart.id}/items/batch/', {'operations': [
+            {'op': 'update', 'id': item.id, 'quantity': 5},
+            {'op': 'add', 'product_id': 0, 'quantity': 1},
+            {'op': 'remove', 'id': 0},
+        ]}, format='json')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['operations'][0] == {}
+        assert 'product_id' in response.data['operations'][1]
+        assert 'id' in response.data['operations'][2]
+        assert api_client.get(f'/store/carts/{cart.id}/items/{item.id}/').data['quantity'] == 1
+
+    def test_if_operation_missing_fields_returns_400(self, api_client: test.APIClient):
+        cart = baker.make(Cart)
+
+        response = api_client.post(f'/store/carts/{cart.id}/items/batch/', {'operations': [
+            {'op': 'update', 'quantity': 5},
+        ]}, format='json')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert 'id' in response.data['operations'][0]
+
+    def test_if_cart_does_not_exist_returns_404(self, api_client: test.APIClient):
+        response = api_client.post('/store/carts/00000000-0000-0000-0000-000000000000/items/batch/', {
+            'operations': [{'op': 'remove', 'id': 1}]}, format='json')
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+class TestCachedCartStore:
+    @pytest.fixture(autouse=True)
+    def cached_store(self, settings):
+        settings.CART_STORE = 'store.carts.CachedCartStore'
+
+    def test_if_quantity_changed_database_waits_for_flush(self, api_client: test.APIClient, scheduled_flushes):
+        cart = baker.make(Cart)
+        item = baker.make(CartItem, cart=cart, quantity=1)
+
+        api_client.patch(f'/store/carts/{cart.id}/items/{item.id}/', {'quantity': 4})
+        api_client.patch(f'/store/carts/{cart.id}/items/{item.id}/', {'quantity': 6})
+
+        item.refresh_from_db()
+        assert item.quantity == 1
+        assert scheduled_flushes == [(str(cart.id),)]
+
+        tasks.flush_cart(str(cart.id))
+
+        item.refresh_from_db()
+        assert item.quantity == 6
+
+    def test_if_removed_item_flushed_row_is_deleted(self, api_client: test.APIClient, scheduled_flushes):
+        cart = baker.make(Cart)
+        item = baker.make(CartItem, cart=cart, quantity=1)
+
+        api_client.delete(f'/store/carts/{cart.id}/items/{item.id}/')
+        get_cart_store().flush(cart.id)
+
+        assert not CartItem.objects.filter(pk=item.id).exists()
+
+    def test_if_removed_item_added_again_row_is_reused(self, api_client: test.APIClient, scheduled_flushes):
+        cart = baker.make(Cart)
+        item = baker.make(CartItem, cart=cart, quantity=1)
+
+        api_client.delete(f'/store/carts/{cart.id}/items/{item.id}/')
+        response = api_client.post(f'/store/carts/{cart.id}/items/', {'product_id': item.product_id, 'quantity': 2})
+        get_cart_store().flush(cart.id)
+
+        assert response.data['id'] == item.id
+        assert list(CartItem.objects.filter(cart=cart).values_list('id', 'quantity')) == [(item.id, 2)]
+
+    def test_if_checkout_rolled_back_removed_items_stay_removed(self, api_client: test.APIClient, scheduled_flushes,
+                                                                django_capture_on_commit_callbacks, monkeypatch):
+        monkeypatch.setattr(tasks.dispatch_outbox, 'delay', lambda: None)
+        api_client.force_authenticate(user=baker.make(User))
+        cart = baker.make(Cart)
+        scarce = baker.make(Product, inventory=1)
+        kept = baker.make(CartItem, cart=cart, product=scarce, quantity=4)
+        removed = baker.make(CartItem, cart=cart, quantity=1, product__inventory=10)
+        api_client.delete(f'/store/carts/{cart.id}/items/{removed.id}/')
+
+        with django_capture_on_commit_callbacks(execute=True):
+            out_of_stock = api_client.post('/store/orders/', {'cart_id': cart.id})
+        Product.objects.filter(pk=scarce.id).update(inventory=10)
+        with django_capture_on_commit_callbacks(execute=True):
+            placed = api_client.post('/store/orders/', {'cart_id': cart.id})
+
+        assert out_of_stock.status_code == status.HTTP_400_BAD_REQUEST
+        assert [(item['product']['id'], item['quantity']) for item in placed.data['items']] == [(kept.product_id, 4)]
+
+    def test_if_cart_retrieved_from_cache_skips_cart_queries(self, api_client: test.APIClient, django_assert_num_queries):
+        cart = baker.make(Cart)
+        baker.make(CartItem, cart=cart, quantity=1, _quantity=3)
+        api_client.get(f'/store/carts/{cart.id}/')
+
+        # The products and their images.
+        with django_assert_num_queries(2):
+            response = api_client.get(f'/store/carts/{cart.id}/')
+
+        assert len(response.data['items']) == 3
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures('cart_store', 'scheduled_flushes')
+class TestCartSummary:
+    def test_if_cart_has_items_returns_count_and_total(self, api_client: test.APIClient):
+        cart = baker.make(Cart)
+        baker.make(CartItem, cart=cart, quantity=2, product__unit_price=Decimal('1.50'))
+        baker.make(CartItem, cart=cart, quantity=1, product__unit_price=Decimal('10.00'))
+
+        response = api_client.get(f'/store/carts/{cart.id}/summary/')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data == {
+            'id': str(cart.id),
+            'items_count': 2,
+            'total_quantity': 3,
+            'total_price': Decimal('13.00'),
+        }
+
+    def test_if_cart_is_empty_returns_zero_total(self, api_client: test.APIClient):
+        cart = baker.make(Cart)
+
+        response = api_client.get(f'/store/carts/{cart.id}/summary/')
+
+        assert (response.data['items_count'], response.data['total_price']) == (0, Decimal('0.00'))
+
+    def test_if_cart_changed_returns_fresh_summary(self, api_client: test.APIClient):
+        cart = baker.make(Cart)
+        item = baker.make(CartItem, cart=cart, quantity=1)
+        api_client.get(f'/store/carts/{cart.id}/summary/')
+
+        api_client.patch(f'/store/carts/{cart.id}/items/{item.id}/', {'quantity': 3})
+        response = api_client.get(f'/store/carts/{cart.id}/summary/')
+
+        assert response.data['total_quantity'] == 3
+
+    def test_if_summary_cached_runs_no_queries(self, api_client: test.APIClient, django_assert_num_queries):
+        cart = baker.make(Cart)
+        baker.make(CartItem, cart=cart, quantity=1)
+        api_client.get(f'/store/carts/{cart.id}/summary/')
+
+        with django_assert_num_queries(0):
+            api_client.get(f'/store/carts/{cart.id}/summary/')
+
+    def test_if_cart_does_not_exist_returns_404(self, api_client: test.APIClient):
+        response = api_client.get('/store/carts/00000000-0000-0000-0000-000000000000/summary/')
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+class TestPurgeExpiredCarts:
+    def test_if_carts_expired_deletes_them_in_chunks_with_items(self, settings):
+        expired = baker.make(Cart, _quantity=5)
+        baker.make(CartItem, cart=expired[0], quantity=1, _quantity=2)
+        Cart.objects.update(created_at=timezone.now() - settings.CART_TTL - timedelta(days=1))
+        active = baker.make(Cart)
+        baker.make(CartItem, cart=active, quantity=1)
+
+        result = tasks.purge_expired_carts(chunk_size=2)
+
+        assert (result['carts'], result['items'], result['chunks']) == (5, 2, 3)
+        assert list(Cart.objects.values_list('id', flat=True)) == [active.id]
+        assert CartItem.objects.filter(cart=active).count() == 1
+
+    def test_if_carts_expired_they_are_deleted_without_being_loaded(self, settings):
+        for cart in baker.make(Cart, _quantity=3):
+            baker.make(CartItem, cart=cart, quantity=1)
+        Cart.objects.update(created_at=timezone.now() - settings.CART_TTL - timedelta(days=1))
+
+        with CaptureQueriesContext(connection) as context:
+            tasks.purge_expired_carts()
+
+        # Only the two id range lookups read anything.
+        selects = [query['sql'] for query in context.captured_queries if query['sql'].startswith('SELECT')]
+        assert len(selects) == 2
+        assert not Cart.objects.exists()
+
+    def test_if_cached_cart_purged_it_is_gone_from_the_cache(self, api_client: test.APIClient, settings,
+                                                             scheduled_flushes):
+        settings.CART_STORE = 'store.carts.CachedCartStore'
+        cart = baker.make(Cart)
+        baker.make(CartItem, cart=cart, quantity=1)
+        api_client.get(f'/store/carts/{cart.id}/')
+        Cart.objects.update(created_at=timezone.now() - settings.CART_TTL - timedelta(days=1))
+
+        tasks.purge_expired_carts()
+        response = api_client.post(f'/store/carts/{cart.id}/items/', {'product_id': baker.make(Product).id, 'quantity': 1})
+
+        assert api_client.get(f'/store/carts/{cart.id}/').status_code == status.HTTP_404_NOT_FOUND
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        assert not CartItem.objects.exists()
+
+    def test_if_no_carts_expired_deletes_nothing(self):
+        baker.make(Cart)
+
+        result = tasks.purge_expired_carts()
+
+        assert (result['carts'], result['chunks']) == (0, 0)
+        assert Cart.objects.count() == 1
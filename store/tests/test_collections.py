@@ -3,9 +3,11 @@
 # the less our test know about our implementations the more accurate it is
 
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from io import StringIO
 from model_bakery import baker
 from rest_framework import status, test
-from store.models import Collection
+from store.models import Collection, Product
 import pytest
 
 User = get_user_model()
@@ -91,6 +93,35 @@ class TestListCollections:
         assert response.status_code == status.HTTP_200_OK
         assert len(response.data) == 0
 
+    def test_if_etag_matches_returns_304(self, api_client: test.APIClient):
+        baker.make(Collection)
+        etag = api_client.get('/store/collections/')['ETag']
+
+        response = api_client.get('/store/collections/', HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    def test_if_product_added_since_etag_returns_200(self, api_client: test.APIClient):
+        collection = baker.make(Collection)
+        etag = api_client.get('/store/collections/')['ETag']
+
+        baker.make(Product, collection=collection)
+        response = api_client.get('/store/collections/', HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data[0]['products_count'] == 1
+
+    def test_if_products_moved_with_update_since_etag_returns_200(self, api_client: test.APIClient):
+        source, target = baker.make(Collection, _quantity=2)
+        baker.make(Product, collection=source)
+        etag = api_client.get('/store/collections/')['ETag']
+
+        Product.objects.filter(collection=source).update(collection=target)
+        response = api_client.get('/store/collections/', HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert {row['id']: row['products_count'] for row in response.data} == {source.id: 0, target.id: 1}
+
 
 
 
@@ -200,4 +231,65 @@ class TestDeleteCollection:
 
         response = api_client.delete(f'/store/collections/{collection.id}/')
 
-        assert response.status_code == status.HTTP_204_NO_CONTENT
\ No newline at end of file
+        assert response.status_code == status.HTTP_204_NO_CONTENT
+
+@pytest.mark.django_db
+class TestCollectionProductsCount:
+    def test_if_product_created_count_increments(self):
+        collection = baker.make(Collection)
+
+        baker.make(Product, collection=collection, _quantity=2)
+
+        collection.refresh_from_db()
+        assert collection.products_count == 2
+
+    def test_if_product_moved_count_follows(self):
+        source, target = baker.make(Collection, _quantity=2)
+        product = baker.make(Product, collection=source)
+
+        product.collection = target
+        product.save()
+
+        source.refresh_from_db()
+        target.refresh_from_db()
+        assert (source.products_count, target.products_count) == (0, 1)
+
+    def test_if_products_moved_with_update_count_follows(self):
+        source, target = baker.make(Collection, _quantity=2)
+        baker.make(Product, collection=source, _quantity=3)
+
+        Product.objects.filter(collection=source).update(collection=target)
+
+        source.refresh_from_db()
+        target.refresh_from_db()
+        assert (source.products_count, target.products_count) == (0, 3)
+
+    def test_if_product_deleted_count_decrements(self):
+        collection = baker.make(Collection)
+        product = baker.make(Product, collection=collection)
+
+        product.delete()
+
+        collection.refresh_from_db()
+        assert collection.products_count == 0
+
+    def test_if_collection_saved_count_is_not_overwritten(self):
+        collection = baker.make(Collection)
+        stale = Collection.objects.get(pk=collection.pk)
+        baker.make(Product, collection=collection)
+
+        stale.title = 'Renamed'
+        stale.save()
+
+        collection.refresh_from_db()
+        assert collection.products_count == 1
+
+    def test_if_count_drifted_reconcile_repairs_it(self):
+        collection = baker.make(Collection)
+        baker.make(Product, collection=collection, _quantity=2)
+        Collection.objects.filter(pk=collection.pk).update(products_count=7)
+
+        call_command('reconcile_products_count', stdout=StringIO())
+
+        collection.refresh_from_db()
+        assert collection.products_count == 2
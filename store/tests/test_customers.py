@@ -0,0 +1,240 @@
+from decimal import Decimal
+from io import StringIO
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.core.management import call_command
+from model_bakery import baker
+from rest_framework import status, test
+from rest_framework_simplejwt.tokens import AccessToken
+from store import tasks
+from store.models import Cart, CartItem, Collection, Customer, CustomerStats, Order, OrderItem, Product
+import pytest
+
+User = get_user_model()
+
+
+@pytest.fixture
+def user():
+    user = baker.make(User, username='alice')
+    user.set_password('s3cret-pass')
+    user.save()
+    return user
+
+
+def obtain_tokens(api_client, user):
+    return api_client.post('/auth/jwt/create/', {'username': user.username, 'password': 's3cret-pass'}).data
+
+
+@pytest.mark.django_db
+class TestCustomerClaim:
+    def test_if_token_obtained_access_token_carries_customer_id(self, api_client: test.APIClient, user):
+        tokens = obtain_tokens(api_client, user)
+
+        assert AccessToken(tokens['access'])['customer_id'] == user.customer.id
+
+    def test_if_user_has_no_customer_token_is_issued_without_claim(self, api_client: test.APIClient, user):
+        Customer.objects.filter(user=user).delete()
+
+        response = api_client.post('/auth/jwt/create/', {'username': user.username, 'password': 's3cret-pass'})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert 'customer_id' not in AccessToken(response.data['access'])
+
+    def test_if_token_refreshed_customer_id_is_kept(self, api_client: test.APIClient, user):
+        refresh = obtain_tokens(api_client, user)['refresh']
+
+        response = api_client.post('/auth/jwt/refresh/', {'refresh': refresh})
+
+        assert AccessToken(response.data['access'])['customer_id'] == user.customer.id
+
+    def test_if_token_carries_customer_id_orders_skip_customer_lookup(self, api_client: test.APIClient, user,
+                                                                     django_assert_num_queries):
+        own = baker.make(Order, customer=user.customer)
+        baker.make(Order, customer=baker.make(User).customer)
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {obtain_tokens(api_client, user)["access"]}')
+
+        # The user, orders and their items; no Customer query.
+        with django_assert_num_queries(3):
+            response = api_client.get('/store/orders/')
+
+        assert [order['id'] for order in response.data['results']] == [own.id]
+
+    def test_if_token_has_no_claim_customer_is_looked_up(self, api_client: test.APIClient, user):
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {AccessToken.for_user(user)}')
+
+        response = api_client.get('/store/customers/me/')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['id'] == user.customer.id
+
+
+@pytest.mark.django_db
+class TestCachedJWTAuthentication:
+    def authenticate(self, api_client, user):
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {obtain_tokens(api_client, user)["access"]}')
+
+    def test_if_user_cached_request_skips_user_query(self, api_client: test.APIClient, user, django_assert_num_queries):
+        self.authenticate(api_client, user)
+        api_client.get('/store/customers/me/')
+
+        # Only the customer.
+        with django_assert_num_queries(1):
+            response = api_client.get('/store/customers/me/')
+
+        assert response.data['id'] == user.customer.id
+
+    def test_if_user_deactivated_cached_user_is_dropped(self, api_client: test.APIClient, user):
+        self.authenticate(api_client, user)
+        api_client.get('/store/customers/me/')
+
+        user.is_active = False
+        user.save()
+        response = api_client.get('/store/customers/me/')
+
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    def test_if_user_changed_request_sees_new_values(self, api_client: test.APIClient, user):
+        self.authenticate(api_client, user)
+        api_client.get('/store/orders/')
+
+        user.is_staff = True
+        user.save()
+        baker.make(Order, customer=baker.make(User).customer)
+        response = api_client.get('/store/orders/')
+
+        assert len(response.data['results']) == 1
+
+
+@pytest.mark.django_db
+class TestCachedPermissions:
+    @pytest.fixture
+    def group(self, user):
+        group = baker.make(Group)
+        group.permissions.add(Permission.objects.get(codename='view_history'))
+        user.groups.add(group)
+        return group
+
+    def get_history(self, api_client, user):
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {AccessToken.for_user(user)}')
+        return api_client.get(f'/store/customers/{user.customer.id}/history/')
+
+    def test_if_permissions_cached_request_skips_permission_queries(self, api_client: test.APIClient, user, group,
+                                                                   django_assert_num_queries):
+        self.get_history(api_client, user)
+
+        # Only the history itself: stats, customer, orders.
+        with django_assert_num_queries(3):
+            response = self.get_history(api_client, user)
+
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_if_user_leaves_group_permission_is_revoked(self, api_client: test.APIClient, user, group):
+        self.get_history(api_client, user)
+
+        user.groups.remove(group)
+
+        assert self.get_history(api_client, user).status_code == status.HTTP_403_FORBIDDEN
+
+    def test_if_group_loses_permission_members_lose_it(self, api_client: test.APIClient, user, group):
+        self.get_history(api_client, user)
+
+        group.permissions.clear()
+
+        assert self.get_history(api_client, user).status_code == status.HTTP_403_FORBIDDEN
+
+    def test_if_permission_granted_directly_it_applies(self, api_client: test.APIClient, user):
+        assert self.get_history(api_client, user).status_code == status.HTTP_403_FORBIDDEN
+
+        user.user_permissions.add(Permission.objects.get(codename='view_history'))
+
+        assert self.get_history(api_client, user).status_code == status.HTTP_200_OK
+
+
+@pytest.mark.django_db
+class TestCustomerHistory:
+    @pytest.fixture
+    def support(self, api_client):
+        api_client.force_authenticate(user=baker.make(User, is_staff=True, is_superuser=True))
+
+    def place_order(self, api_client, user, product, quantity):
+        api_client.force_authenticate(user=user)
+        cart = baker.make(Cart)
+        baker.make(CartItem, cart=cart, product=product, quantity=quantity)
+        return api_client.post('/store/orders/', {'cart_id': cart.id}).data['id']
+
+    def test_if_orders_placed_and_paid_history_reflects_them(self, api_client: test.APIClient, user):
+        books, games = baker.make(Collection, _quantity=2)
+        book = baker.make(Product, collection=books, unit_price=Decimal('4.00'), inventory=10)
+        game = baker.make(Product, collection=games, unit_price=Decimal('30.00'), inventory=10)
+        self.place_order(api_client, user, book, 3)
+        paid = self.place_order(api_client, user, game, 1)
+        api_client.force_authenticate(user=baker.make(User, is_staff=True, is_superuser=True))
+        api_client.patch(f'/store/orders/{paid}/', {'payment_status': Order.PAYMENT_STATUS_COMPLETE})
+        tasks.dispatch_outbox()
+
+        response = api_client.get(f'/store/customers/{user.customer.id}/history/')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert (response.data['orders_count'], response.data['lifetime_spend']) == (2, Decimal('30.00'))
+        assert response.data['last_order_at'] == Order.objects.get(pk=paid).placed_at.isoformat().replace('+00:00', 'Z')
+        assert response.data['favourite_collection']['id'] == books.id
+        assert [order['id'] for order in response.data['recent_orders']['results']] == [paid, paid - 1]
+
+    def test_if_many_orders_recent_orders_are_paginated(self, api_client: test.APIClient, user, support):
+        orders = baker.make(Order, customer=user.customer, _quantity=12)
+
+        first = api_client.get(f'/store/customers/{user.customer.id}/history/')
+        second = api_client.get(first.data['recent_orders']['next'])
+
+        assert [order['id'] for order in first.data['recent_orders']['results']] == \
+            [order.id for order in reversed(orders[2:])]
+        assert [order['id'] for order in second.data['recent_orders']['results']] == [orders[1].id, orders[0].id]
+
+    def test_if_customer_never_ordered_returns_empty_stats(self, api_client: test.APIClient, user, support):
+        response = api_client.get(f'/store/customers/{user.customer.id}/history/')
+
+        assert response.data['orders_count'] == 0
+        assert response.data['favourite_collection'] is None
+        assert response.data['recent_orders']['results'] == []
+
+    def test_if_customer_does_not_exist_returns_404(self, api_client: test.APIClient, support):
+        response = api_client.get('/store/customers/0/history/')
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_if_customer_id_is_not_a_number_returns_404(self, api_client: test.APIClient, support):
+        response = api_client.get('/store/customers/abc/history/')
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_if_order_deleted_history_leaves_it_out(self, api_client: test.APIClient, user):
+        books, games = baker.make(Collection, _quantity=2)
+        book = baker.make(Product, collection=books, unit_price=Decimal('4.00'), inventory=10)
+        game = baker.make(Product, collection=games, unit_price=Decimal('30.00'), inventory=10)
+        kept = self.place_order(api_client, user, book, 1)
+        deleted = self.place_order(api_client, user, game, 3)
+        api_client.force_authenticate(user=baker.make(User, is_staff=True, is_superuser=True))
+        api_client.patch(f'/store/orders/{deleted}/', {'payment_status': Order.PAYMENT_STATUS_COMPLETE})
+        tasks.dispatch_outbox()
+        OrderItem.objects.filter(order_id=deleted).delete()
+
+        api_client.delete(f'/store/orders/{deleted}/')
+        response = api_client.get(f'/store/customers/{user.customer.id}/history/')
+
+        assert (response.data['orders_count'], response.data['lifetime_spend']) == (1, Decimal('0.00'))
+        assert response.data['last_order_at'] == Order.objects.get(pk=kept).placed_at.isoformat().replace('+00:00', 'Z')
+        assert response.data['favourite_collection']['id'] == books.id
+
+    def test_if_stats_rebuilt_they_match_incremental_ones(self, api_client: test.APIClient, user):
+        product = baker.make(Product, unit_price=Decimal('2.00'), inventory=10)
+        order_id = self.place_order(api_client, user, product, 2)
+        self.place_order(api_client, user, product, 1)
+        api_client.force_authenticate(user=baker.make(User, is_staff=True))
+        api_client.patch(f'/store/orders/{order_id}/', {'payment_status': Order.PAYMENT_STATUS_COMPLETE})
+        tasks.dispatch_outbox()
+        columns = ['orders_count', 'lifetime_spend', 'last_order_at', 'favourite_collection_id']
+        incremental = list(CustomerStats.objects.values_list(*columns))
+
+        call_command('rebuild_sales_rollups', stdout=StringIO())
+
+        assert list(CustomerStats.objects.values_list(*columns)) == incremental
@@ -0,0 +1,292 @@
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from model_bakery import baker
+from rest_framework import status, test
+from store import idempotency, tasks
+from store.models import Cart, CartItem, Order, OrderItem, OrderRequest, OutboxEvent, Product, ProductImage
+from store.signals import order_created
+import pytest
+
+User = get_user_model()
+
+
+@pytest.fixture
+def customer_user():
+    return baker.make(User)
+
+
+@pytest.mark.django_db
+class TestCreateOrder:
+    def test_if_stock_is_enough_reserves_inventory_and_returns_order(self, api_client: test.APIClient, customer_user):
+        api_client.force_authenticate(user=customer_user)
+        product = baker.make(Product, inventory=5)
+        cart = baker.make(Cart)
+        baker.make(CartItem, cart=cart, product=product, quantity=3)
+
+        response = api_client.post('/store/orders/', {'cart_id': cart.id})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['items'][0]['quantity'] == 3
+        product.refresh_from_db()
+        assert product.inventory == 2
+        assert not Cart.objects.filter(pk=cart.id).exists()
+
+    def test_if_any_item_is_short_returns_400_and_reserves_nothing(self, api_client: test.APIClient, customer_user):
+        api_client.force_authenticate(user=customer_user)
+        plenty, scarce = baker.make(Product, inventory=10), baker.make(Product, inventory=1)
+        cart = baker.make(Cart)
+        baker.make(CartItem, cart=cart, product=plenty, quantity=2)
+        baker.make(CartItem, cart=cart, product=scarce, quantity=3)
+
+        response = api_client.post('/store/orders/', {'cart_id': cart.id})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['items'] == [
+            {'product_id': scarce.id, 'requested': 3, 'available': 1, 'detail': 'Not enough items in stock.'}]
+        assert list(Product.objects.order_by('id').values_list('inventory', flat=True)) == [10, 1]
+        assert not Order.objects.exists()
+        assert Cart.objects.filter(pk=cart.id).exists()
+
+
+@pytest.fixture
+def queued_batches(monkeypatch):
+    calls = []
+    monkeypatch.setattr(tasks.process_order_requests, 'delay', lambda: calls.append(True))
+    return calls
+
+
+@pytest.mark.django_db
+class TestCreateOrderAsync:
+    def test_if_async_preferred_returns_202_and_queues_request(self, api_client: test.APIClient, customer_user, queued_batches,
+                                                              django_capture_on_commit_callbacks):
+        api_client.force_authenticate(user=customer_user)
+        cart = baker.make(Cart)
+        baker.make(CartItem, cart=cart, quantity=1)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            response = api_client.post('/store/orders/', {'cart_id': cart.id}, HTTP_PREFER='respond-async')
+
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert response.data['status'] == OrderRequest.STATUS_PENDING
+        assert response['Location'].endswith(f'/store/orders/requests/{response.data["id"]}/')
+        assert queued_batches == [True]
+        assert not Order.objects.exists()
+
+    def test_if_request_processed_status_returns_order(self, api_client: test.APIClient, customer_user, queued_batches):
+        api_client.force_authenticate(user=customer_user)
+        cart = baker.make(Cart)
+        baker.make(CartItem, cart=cart, quantity=1, product__inventory=5)
+        response = api_client.post('/store/orders/', {'cart_id': cart.id}, HTTP_PREFER='respond-async')
+
+        assert tasks.process_order_requests() == 1
+        status_response = api_client.get(f'/store/orders/requests/{response.data["id"]}/')
+
+        assert status_response.data['status'] == OrderRequest.STATUS_PLACED
+        assert status_response.data['order_id'] == Order.objects.get().id
+
+    def test_if_request_out_of_stock_status_returns_errors(self, api_client: test.APIClient, customer_user, queued_batches):
+        api_client.force_authenticate(user=customer_user)
+        placed, short = baker.make(Cart, _quantity=2)
+        product = baker.make(Product, inventory=1)
+        baker.make(CartItem, cart=placed, product=product, quantity=1)
+        baker.make(CartItem, cart=short, product=product, quantity=1)
+        first = api_client.post('/store/orders/', {'cart_id': placed.id}, HTTP_PREFER='respond-async')
+        second = api_client.post('/store/orders/', {'cart_id': short.id}, HTTP_PREFER='respond-async')
+
+        tasks.process_order_requests()
+
+        assert OrderRequest.objects.get(pk=first.data['id']).status == OrderRequest.STATUS_PLACED
+        failed = OrderRequest.objects.get(pk=second.data['id'])
+        assert failed.status == OrderRequest.STATUS_FAILED
+        assert failed.errors['items'][0]['product_id'] == product.id
+
+    def test_if_request_fails_unexpectedly_others_in_batch_are_placed(self, api_client: test.APIClient, customer_user,
+                                                                      queued_batches, monkeypatch):
+        api_client.force_authenticate(user=customer_user)
+        broken, ok = baker.make(Cart, _quantity=2)
+        baker.make(CartItem, cart=broken, quantity=1, product__inventory=5)
+        baker.make(CartItem, cart=ok, quantity=1, product__inventory=5)
+        first = api_client.post('/store/orders/', {'cart_id': broken.id}, HTTP_PREFER='respond-async')
+        second = api_client.post('/store/orders/', {'cart_id': ok.id}, HTTP_PREFER='respond-async')
+        place_order = tasks.place_order
+
+        def fail_for_broken_cart(cart_id, customer_id):
+            if cart_id == broken.id:
+                raise RuntimeError('Cache unavailable')
+            return place_order(cart_id, customer_id)
+
+        monkeypatch.setattr(tasks, 'place_order', fail_for_broken_cart)
+
+        assert tasks.process_order_requests() == 2
+
+        failed = OrderRequest.objects.get(pk=first.data['id'])
+        assert (failed.status, failed.errors) == (OrderRequest.STATUS_FAILED, {'detail': 'The order could not be placed.'})
+        assert OrderRequest.objects.get(pk=second.data['id']).status == OrderRequest.STATUS_PLACED
+
+    def test_if_request_belongs_to_another_customer_returns_404(self, api_client: test.APIClient, customer_user):
+        order_request = baker.make(OrderRequest, customer=baker.make(User).customer)
+        api_client.force_authenticate(user=customer_user)
+
+        response = api_client.get(f'/store/orders/requests/{order_request.id}/')
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+class TestListOrders:
+    def make_orders(self, count):
+        customer = baker.make(User).customer
+        for order in baker.make(Order, customer=customer, _quantity=count):
+            for item in baker.make(OrderItem, order=order, unit_price=1, _quantity=2):
+                baker.make(ProductImage, product=item.product)
+
+    @pytest.mark.parametrize('count', [3, 25])
+    def test_if_staff_lists_orders_query_count_is_constant(self, api_client: test.APIClient, django_assert_num_queries, count):
+        self.make_orders(count)
+        api_client.force_authenticate(user=User(is_staff=True))
+
+        # Orders, items with their products, images.
+        with django_assert_num_queries(3):
+            response = api_client.get('/store/orders/')
+
+        assert len(response.data['results']) == min(count, 10)
+        assert all(len(order['items']) == 2 for order in response.data['results'])
+
+    def test_if_customer_lists_orders_returns_only_theirs(self, api_client: test.APIClient, customer_user):
+        own = baker.make(Order, customer=customer_user.customer)
+        baker.make(Order, customer=baker.make(User).customer)
+        api_client.force_authenticate(user=customer_user)
+
+        response = api_client.get('/store/orders/')
+
+        assert [order['id'] for order in response.data['results']] == [own.id]
+
+    def test_if_filtered_by_payment_status_returns_matching_orders(self, api_client: test.APIClient):
+        customer = baker.make(User).customer
+        complete = baker.make(Order, customer=customer, payment_status=Order.PAYMENT_STATUS_COMPLETE)
+        baker.make(Order, customer=customer, payment_status=Order.PAYMENT_STATUS_PENDING)
+        api_client.force_authenticate(user=User(is_staff=True))
+
+        response = api_client.get('/store/orders/', {'payment_status': Order.PAYMENT_STATUS_COMPLETE})
+
+        assert [order['id'] for order in response.data['results']] == [complete.id]
+
+    def test_if_filtered_by_placed_at_range_returns_orders_in_range(self, api_client: test.APIClient):
+        old, recent = baker.make(Order, customer=baker.make(User).customer, _quantity=2)
+        Order.objects.filter(pk=old.pk).update(placed_at=timezone.now() - timedelta(days=10))
+        api_client.force_authenticate(user=User(is_staff=True))
+
+        response = api_client.get('/store/orders/', {
+            'placed_at__gte': (timezone.now() - timedelta(days=1)).isoformat()})
+
+        assert [order['id'] for order in response.data['results']] == [recent.id]
+
+
+@pytest.fixture
+def order_receiver():
+    received = []
+
+    def receiver(sender, order, **kwargs):
+        received.append(order.id)
+
+    order_created.connect(receiver, weak=False)
+    yield received
+    order_created.disconnect(receiver)
+
+
+@pytest.mark.django_db
+class TestOrderCreatedOutbox:
+    def place_order(self, api_client, customer_user):
+        api_client.force_authenticate(user=customer_user)
+        cart = baker.make(Cart)
+        baker.make(CartItem, cart=cart, quantity=1, product__inventory=1)
+        return api_client.post('/store/orders/', {'cart_id': cart.id})
+
+    def test_if_order_placed_event_is_stored_not_sent(self, api_client: test.APIClient, customer_user, order_receiver):
+        response = self.place_order(api_client, customer_user)
+
+        event = OutboxEvent.objects.get()
+        assert (event.name, event.payload) == ('order_created', {'order_id': response.data['id']})
+        assert order_receiver == []
+
+    def test_if_outbox_dispatched_receivers_get_order_once(self, api_client: test.APIClient, customer_user, order_receiver):
+        response = self.place_order(api_client, customer_user)
+
+        assert tasks.dispatch_outbox() == 1
+        assert tasks.dispatch_outbox() == 0
+
+        assert order_receiver == [response.data['id']]
+        assert OutboxEvent.objects.get().dispatched_at is not None
+
+    def test_if_receiver_fails_event_is_retried_later(self, api_client: test.APIClient, customer_user):
+        self.place_order(api_client, customer_user)
+
+        def fail(sender, **kwargs):
+            raise RuntimeError('Mail server down')
+
+        order_created.connect(fail, weak=False)
+        try:
+            assert tasks.dispatch_outbox() == 0
+        finally:
+            order_created.disconnect(fail)
+
+        event = OutboxEvent.objects.get()
+        assert (event.attempts, event.dispatched_at) == (1, None)
+        assert 'Mail server down' in event.last_error
+        assert event.available_at > timezone.now()
+
+
+@pytest.mark.django_db
+class TestCreateOrderIdempotency:
+    def make_cart(self):
+        cart = baker.make(Cart)
+        baker.make(CartItem, cart=cart, quantity=1, product__inventory=5)
+        return cart
+
+    def test_if_request_repeated_replays_first_order(self, api_client: test.APIClient, customer_user):
+        api_client.force_authenticate(user=customer_user)
+        cart = self.make_cart()
+
+        first = api_client.post('/store/orders/', {'cart_id': cart.id}, HTTP_IDEMPOTENCY_KEY='checkout-1')
+        second = api_client.post('/store/orders/', {'cart_id': cart.id}, HTTP_IDEMPOTENCY_KEY='checkout-1')
+
+        assert first.status_code == second.status_code == status.HTTP_200_OK
+        assert second.data == first.data
+        assert second['Idempotent-Replayed'] == 'true'
+        assert Order.objects.count() == 1
+
+    def test_if_key_reused_for_other_request_returns_422(self, api_client: test.APIClient, customer_user):
+        api_client.force_authenticate(user=customer_user)
+        api_client.post('/store/orders/', {'cart_id': self.make_cart().id}, HTTP_IDEMPOTENCY_KEY='checkout-1')
+
+        response = api_client.post('/store/orders/', {'cart_id': self.make_cart().id}, HTTP_IDEMPOTENCY_KEY='checkout-1')
+
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        assert Order.objects.count() == 1
+
+    def test_if_first_request_still_running_returns_409(self, api_client: test.APIClient, customer_user, settings, monkeypatch):
+        settings.IDEMPOTENCY_WAIT = 0
+        api_client.force_authenticate(user=customer_user)
+        cart = self.make_cart()
+        # Another worker holds the key for the same request.
+        monkeypatch.setattr(idempotency.cache, 'add', lambda *args, **kwargs: False)
+        monkeypatch.setattr(idempotency.cache, 'get', lambda *args, **kwargs: {'state': idempotency.PENDING})
+
+        response = api_client.post('/store/orders/', {'cart_id': cart.id}, HTTP_IDEMPOTENCY_KEY='checkout-1')
+
+        assert response.status_code == status.HTTP_409_CONFLICT
+        assert not Order.objects.exists()
+
+    def test_if_cache_is_unavailable_gives_up_after_wait(self, api_client: test.APIClient, customer_user, settings, monkeypatch):
+        settings.IDEMPOTENCY_WAIT = 0
+        api_client.force_authenticate(user=customer_user)
+        cart = self.make_cart()
+        # What a cache that ignores its errors answers during an outage.
+        monkeypatch.setattr(idempotency.cache, 'add', lambda *args, **kwargs: False)
+        monkeypatch.setattr(idempotency.cache, 'get', lambda *args, **kwargs: None)
+
+        response = api_client.post('/store/orders/', {'cart_id': cart.id}, HTTP_IDEMPOTENCY_KEY='checkout-1')
+
+        assert response.status_code == status.HTTP_409_CONFLICT
+        assert not Order.objects.exists()
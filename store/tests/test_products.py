@@ -1,7 +1,16 @@
+from datetime import timedelta
+from decimal import Decimal
+import json
 from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from model_bakery import baker
 from rest_framework import status, test
-from store.models import Collection, Product
+from rest_framework.renderers import JSONRenderer
+from store.imports import ProductImporter
+from store.models import Collection, Product, ProductImage, Promotion
+from store.serializers import ProductSerializer
 import pytest
 
 User = get_user_model()
@@ -115,6 +124,19 @@ class TestListProduct:
         assert response.status_code == status.HTTP_200_OK
         assert len(response.data['results']) == 0
 
+    def test_if_products_listed_renders_same_json_as_serializer(self, api_client: test.APIClient, rf):
+        products = baker.make(Product, unit_price=Decimal('12.34'), _quantity=3)
+        products[0].description = None
+        products[0].save()
+        baker.make(ProductImage, product=products[1], image='store/product/images/a.jpg', _quantity=2)
+
+        response = api_client.get('/store/products/')
+
+        request = rf.get('/store/products/')
+        serializer = ProductSerializer(
+            Product.objects.with_effective_price().prefetch_related('images'), many=True, context={'request': request})
+        assert JSONRenderer().render(response.data['results']) == JSONRenderer().render(serializer.data)
+
 
 @pytest.mark.django_db
 class TestUpdateProduct:
@@ -194,4 +216,376 @@ class TestDeleteProduct:
 
         response = api_client.delete(f'/store/products/{product.id}/')
 
-        assert response.status_code == status.HTTP_204_NO_CONTENT
\ No newline at end of file
+        assert response.status_code == status.HTTP_204_NO_CONTENT
+
+@pytest.mark.django_db
+class TestProductCache:
+    def test_if_product_list_is_cached_returns_same_data_without_queries(self, api_client: test.APIClient, django_assert_num_queries):
+        baker.make(Product, _quantity=3)
+        first = api_client.get('/store/products/')
+
+        with django_assert_num_queries(0):
+            second = api_client.get('/store/products/')
+
+        assert second.status_code == status.HTTP_200_OK
+        assert second.data == first.data
+
+    def test_if_product_is_updated_list_returns_fresh_data(self, api_client: test.APIClient):
+        product = baker.make(Product)
+        api_client.get('/store/products/')
+
+        product.title = 'Updated Title'
+        product.save()
+        response = api_client.get('/store/products/')
+
+        assert response.data['results'][0]['title'] == 'Updated Title'
+
+    def test_if_product_moves_collection_filtered_lists_are_invalidated(self, api_client: test.APIClient):
+        product = baker.make(Product)
+        old_collection_id = product.collection_id
+        new_collection = baker.make(Collection)
+        api_client.get('/store/products/', {'collection_id': old_collection_id})
+        api_client.get('/store/products/', {'collection_id': new_collection.id})
+
+        product.collection = new_collection
+        product.save()
+        old_response = api_client.get('/store/products/', {'collection_id': old_collection_id})
+        new_response = api_client.get('/store/products/', {'collection_id': new_collection.id})
+
+        assert len(old_response.data['results']) == 0
+        assert len(new_response.data['results']) == 1
+
+    def test_if_product_is_deleted_retrieve_returns_404(self, api_client: test.APIClient):
+        product = baker.make(Product)
+        api_client.get(f'/store/products/{product.id}/')
+
+        product.delete()
+        response = api_client.get(f'/store/products/{product.id}/')
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+class TestListProductWithCursor:
+    def test_if_cursor_pages_are_followed_returns_every_product_once(self, api_client: test.APIClient):
+        collection = baker.make(Collection)
+        products = baker.make(Product, collection=collection, unit_price=10, _quantity=25)
+
+        ids = []
+        response = api_client.get('/store/products/', {'cursor': '', 'ordering': 'unit_price'})
+        while True:
+            assert response.status_code == status.HTTP_200_OK
+            ids += [product['id'] for product in response.data['results']]
+            if response.data['next'] is None:
+                break
+            response = api_client.get(response.data['next'])
+
+        assert 'count' not in response.data
+        assert sorted(ids) == sorted(product.id for product in products)
+        assert len(ids) == len(set(ids))
+
+    def test_if_ordered_by_close_timestamps_returns_every_product_once(self, api_client: test.APIClient):
+        products = baker.make(Product, _quantity=25)
+        start = timezone.now()
+        for i, product in enumerate(products):
+            # Several rows per millisecond.
+            Product.objects.filter(pk=product.pk).update(last_update=start + timedelta(microseconds=200 * i))
+
+        ids = []
+        response = api_client.get('/store/products/', {'cursor': '', 'ordering': 'last_update'})
+        while True:
+            ids += [product['id'] for product in response.data['results']]
+            if response.data['next'] is None:
+                break
+            response = api_client.get(response.data['next'])
+
+        assert ids == [product.id for product in products]
+
+    def test_if_previous_link_is_followed_returns_previous_page(self, api_client: test.APIClient):
+        baker.make(Product, _quantity=15)
+        first = api_client.get('/store/products/', {'cursor': ''})
+        second = api_client.get(first.data['next'])
+
+        response = api_client.get(second.data['previous'])
+
+        assert response.data['results'] == first.data['results']
+        assert response.data['previous'] is None
+
+    def test_if_count_is_requested_returns_estimated_count(self, api_client: test.APIClient):
+        baker.make(Product, _quantity=12)
+
+        response = api_client.get('/store/products/', {'cursor': '', 'count': 'true'})
+
+        assert response.data['count'] == 12
+
+    def test_if_cursor_is_invalid_returns_404(self, api_client: test.APIClient):
+        response = api_client.get('/store/products/', {'cursor': 'not-a-cursor'})
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+class TestSearchProduct:
+    def test_if_term_is_a_prefix_returns_matching_products(self, api_client: test.APIClient):
+        match = baker.make(Product, title='Espresso Machine', description='')
+        baker.make(Product, title='Teapot', description='')
+
+        response = api_client.get('/store/products/', {'search': 'espr'})
+
+        assert [product['id'] for product in response.data['results']] == [match.id]
+
+    def test_if_terms_match_returns_title_matches_first(self, api_client: test.APIClient):
+        description_match = baker.make(Product, title='Grinder', description='For coffee beans')
+        title_match = baker.make(Product, title='Coffee Beans', description='')
+
+        response = api_client.get('/store/products/', {'search': 'coffee beans'})
+
+        assert [product['id'] for product in response.data['results']] == [title_match.id, description_match.id]
+
+    def test_if_product_is_saved_or_deleted_index_is_updated(self, api_client: test.APIClient):
+        product = baker.make(Product, title='Kettle', description='')
+        product_id = product.id
+        api_client.get('/store/products/', {'search': 'kettle'})
+
+        product.title = 'Toaster'
+        product.save()
+        renamed = api_client.get('/store/products/', {'search': 'toast'})
+        product.delete()
+        deleted = api_client.get('/store/products/', {'search': 'toast'})
+
+        assert [product['id'] for product in renamed.data['results']] == [product_id]
+        assert deleted.data['results'] == []
+
+
+@pytest.mark.django_db
+class TestConditionalGetProduct:
+    def test_if_etag_matches_returns_304_without_queries(self, api_client: test.APIClient, django_assert_num_queries):
+        product = baker.make(Product)
+        response = api_client.get(f'/store/products/{product.id}/')
+
+        with django_assert_num_queries(0):
+            response = api_client.get(f'/store/products/{product.id}/', HTTP_IF_NONE_MATCH=response['ETag'])
+
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    def test_if_product_changed_since_etag_returns_200(self, api_client: test.APIClient):
+        product = baker.make(Product)
+        etag = api_client.get('/store/products/')['ETag']
+
+        product.title = 'Updated Title'
+        product.save()
+        response = api_client.get('/store/products/', HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response['ETag'] != etag
+
+    def test_if_not_modified_since_last_modified_returns_304(self, api_client: test.APIClient):
+        baker.make(Product)
+        last_modified = api_client.get('/store/products/')['Last-Modified']
+
+        response = api_client.get('/store/products/', HTTP_IF_MODIFIED_SINCE=last_modified)
+
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+
+@pytest.mark.django_db
+class TestSparseFieldsetProduct:
+    def test_if_fields_requested_list_returns_only_those_without_images_query(self, api_client: test.APIClient, django_assert_num_queries):
+        baker.make(Product, _quantity=3)
+
+        with django_assert_num_queries(2):
+            response = api_client.get('/store/products/', {'fields': 'id,title,unit_price'})
+
+        assert all(set(product) == {'id', 'title', 'unit_price'} for product in response.data['results'])
+
+    def test_if_fields_requested_retrieve_returns_only_those(self, api_client: test.APIClient):
+        product = baker.make(Product)
+
+        response = api_client.get(f'/store/products/{product.id}/', {'fields': 'id,price_with_tax'})
+
+        assert set(response.data) == {'id', 'price_with_tax'}
+
+    def test_if_collection_expanded_list_and_retrieve_return_nested_collection(self, api_client: test.APIClient):
+        product = baker.make(Product)
+        expected = {'id': product.collection.id, 'title': product.collection.title, 'products_count': 1}
+
+        list_response = api_client.get('/store/products/', {'expand': 'collection'})
+        retrieve_response = api_client.get(f'/store/products/{product.id}/', {'expand': 'collection'})
+
+        assert list_response.data['results'][0]['collection'] == expected
+        assert retrieve_response.data['collection'] == expected
+
+
+@pytest.mark.django_db
+class TestEffectivePriceProduct:
+    def test_if_product_has_promotions_returns_price_after_best_discount(self, api_client: test.APIClient):
+        product = baker.make(Product, unit_price=Decimal('100.00'))
+        product.promotions.set([baker.make(Promotion, discount=10), baker.make(Promotion, discount=25)])
+
+        response = api_client.get(f'/store/products/{product.id}/')
+
+        assert response.data['effective_price'] == Decimal('75.00')
+        assert response.data['effective_price_with_tax'] == Decimal('82.50')
+
+    def test_if_filtered_and_ordered_by_effective_price_returns_matching_products(self, api_client: test.APIClient):
+        discounted = baker.make(Product, unit_price=Decimal('50.00'))
+        discounted.promotions.add(baker.make(Promotion, discount=50))
+        cheap = baker.make(Product, unit_price=Decimal('30.00'))
+        baker.make(Product, unit_price=Decimal('80.00'))
+
+        response = api_client.get('/store/products/', {'effective_price__lt': 40, 'ordering': 'effective_price'})
+
+        assert [product['id'] for product in response.data['results']] == [discounted.id, cheap.id]
+
+    def test_if_promotion_is_added_list_returns_fresh_price(self, api_client: test.APIClient):
+        product = baker.make(Product, unit_price=Decimal('20.00'))
+        api_client.get('/store/products/')
+
+        product.promotions.add(baker.make(Promotion, discount=50))
+        response = api_client.get('/store/products/')
+
+        assert response.data['results'][0]['effective_price'] == Decimal('10.00')
+
+    def test_if_unit_price_updated_returns_prices_after_save(self, api_client: test.APIClient, admin_user):
+        product = baker.make(Product, unit_price=Decimal('10.00'))
+        api_client.force_authenticate(user=admin_user)
+
+        response = api_client.patch(f'/store/products/{product.id}/', {'unit_price': '20.00'})
+
+        assert response.data['effective_price'] == Decimal('20.00')
+        assert response.data['effective_price_with_tax'] == Decimal('22.00')
+        assert response.data['price_with_tax'] == Decimal('22.00')
+
+    def test_if_product_created_returns_effective_prices(self, api_client: test.APIClient, admin_user, valid_product_data):
+        api_client.force_authenticate(user=admin_user)
+
+        response = api_client.post('/store/products/', {**valid_product_data, 'unit_price': '20.00'})
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data['effective_price'] == Decimal('20.00')
+        assert response.data['effective_price_with_tax'] == Decimal('22.00')
+
+
+@pytest.mark.django_db
+class TestFacetsProduct:
+    def test_if_facets_requested_returns_counts_for_filtered_products(self, api_client: test.APIClient):
+        collection = baker.make(Collection)
+        promotion = baker.make(Promotion)
+        baker.make(Product, collection=collection, unit_price=Decimal('10.00'), promotions=[promotion])
+        baker.make(Product, collection=collection, unit_price=Decimal('60.00'))
+        baker.make(Product, unit_price=Decimal('20.00'))
+
+        response = api_client.get('/store/products/', {'facets': 'true', 'collection_id': collection.id})
+
+        facets = response.data['facets']
+        assert facets['collections'] == [{'id': collection.id, 'title': collection.title, 'count': 2}]
+        assert [bucket['count'] for bucket in facets['prices']] == [1, 0, 1, 0, 0, 0]
+        assert facets['promotions'] == [{'id': promotion.id, 'description': promotion.description, 'count': 1}]
+
+    def test_if_facets_not_requested_returns_no_facets(self, api_client: test.APIClient):
+        response = api_client.get('/store/products/')
+
+        assert 'facets' not in response.data
+
+
+@pytest.mark.django_db
+class TestExportProduct:
+    def test_if_user_is_not_admin_returns_403(self, api_client: test.APIClient, regular_user):
+        api_client.force_authenticate(regular_user)
+
+        response = api_client.get('/store/products/export/')
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    def test_if_user_is_admin_streams_every_product_as_ndjson(self, api_client: test.APIClient, admin_user):
+        promotion = baker.make(Promotion)
+        products = baker.make(Product, promotions=[promotion], _quantity=3)
+        api_client.force_authenticate(admin_user)
+
+        response = api_client.get('/store/products/export/')
+
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        rows = [json.loads(line) for line in lines]
+        assert response['Content-Type'] == 'application/x-ndjson'
+        assert [row['id'] for row in rows] == sorted(product.id for product in products)
+        assert rows[0]['promotions'][0]['id'] == promotion.id
+        assert rows[0]['collection']['id'] == products[0].collection_id
+
+    def test_if_user_is_admin_streams_csv_with_header(self, api_client: test.APIClient, admin_user):
+        baker.make(Product, _quantity=2)
+        api_client.force_authenticate(admin_user)
+
+        response = api_client.get('/store/products/export/', {'output': 'csv'})
+
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        assert lines[0].startswith('id,title,slug')
+        assert len(lines) == 3
+
+
+@pytest.mark.django_db
+class TestBulkImportProduct:
+    def test_if_user_is_not_admin_returns_403(self, api_client: test.APIClient, regular_user):
+        api_client.force_authenticate(regular_user)
+
+        response = api_client.post('/store/products/bulk/', [], format='json')
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    def test_if_rows_are_posted_upserts_on_slug_and_reports_errors(self, api_client: test.APIClient, admin_user):
+        collection = baker.make(Collection)
+        existing = baker.make(Product, slug='kettle', collection=collection, unit_price=Decimal('10.00'))
+        api_client.force_authenticate(admin_user)
+        rows = [
+            {'title': 'Kettle', 'slug': 'kettle', 'unit_price': '12.50', 'inventory': 5, 'collection_id': collection.id},
+            {'title': 'Toaster', 'slug': 'toaster', 'unit_price': '30.00', 'inventory': 2, 'collection_id': collection.id},
+            {'title': 'Broken', 'slug': 'broken', 'unit_price': '-1', 'inventory': 2, 'collection_id': collection.id},
+            {'title': 'Orphan', 'slug': 'orphan', 'unit_price': '5.00', 'inventory': 2, 'collection_id': 0},
+        ]
+
+        response = api_client.post('/store/products/bulk/', rows, format='json')
+
+        existing.refresh_from_db()
+        assert response.data['created'] == 1
+        assert response.data['updated'] == 1
+        assert [error['row'] for error in response.data['errors']] == [3, 4]
+        assert existing.unit_price == Decimal('12.50')
+        assert Product.objects.filter(slug='toaster').exists()
+
+    def test_if_csv_is_posted_creates_products_and_invalidates_list(self, api_client: test.APIClient, admin_user):
+        collection = baker.make(Collection)
+        api_client.get('/store/products/')
+        api_client.force_authenticate(admin_user)
+        body = (
+            'title,slug,unit_price,inventory,collection_id\n'
+            f'Mug,mug,4.50,10,{collection.id}\n'
+        )
+
+        response = api_client.post('/store/products/bulk/', body, content_type='text/csv')
+        api_client.force_authenticate(None)
+        listed = api_client.get('/store/products/')
+
+        assert response.data['created'] == 1
+        assert [product['title'] for product in listed.data['results']] == ['Mug']
+
+    def test_if_many_rows_update_products_query_count_stays_flat(self):
+        collection = baker.make(Collection)
+        baker.make(Product, slug=iter(f'product-{n}' for n in range(20)), collection=collection, _quantity=20)
+
+        def update(count):
+            rows = [{'title': 'Updated', 'slug': f'product-{n}', 'unit_price': '5.00', 'inventory': 1,
+                     'collection_id': collection.id} for n in range(count)]
+            with CaptureQueriesContext(connection) as context:
+                ProductImporter().run(rows)
+            return len(context)
+
+        assert update(20) == update(1)
+
+    def test_if_body_is_not_utf8_returns_400(self, api_client: test.APIClient, admin_user):
+        api_client.force_authenticate(admin_user)
+        body = 'title,slug,unit_price,inventory,collection_id\nCaf\xe9,cafe,4.50,10,1\n'.encode('latin-1')
+
+        response = api_client.post('/store/products/bulk/', body, content_type='text/csv')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert 'error' in response.data
+        assert not Product.objects.exists()
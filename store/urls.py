@@ -8,7 +8,10 @@ router.register('products', views.ProductViewSet, basename='products')
 router.register('collections', views.CollectionViewSet)
 router.register('carts', views.CartViewSet)
 router.register('customers', views.CustomerViewSet)
+# Registered ahead of orders so requests/ isn't read as an order id.
+router.register('orders/requests', views.OrderRequestViewSet, basename='order-requests')
 router.register('orders', views.OrderViewSet, basename='orders')
+router.register('analytics/sales', views.SalesAnalyticsViewSet, basename='sales-analytics')
 
 products_router = routers.NestedDefaultRouter(
     router, 'products', lookup='product')
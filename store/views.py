@@ -1,33 +1,136 @@
+from store.cache import COLLECTIONS_SCOPE, PRODUCTS_SCOPE, PROMOTIONS_SCOPE, CachedResponseMixin, ConditionalGetMixin, collection_scope, get_version, reviews_scope
 from store.permissions import FullDjangoModelPermissions, IsAdminOrReadOnly, ViewCustomerHistoryPermission
-from store.pagination import DefaultPagination
-from django.db.models.aggregates import Count
+from store.pagination import KeysetPagination, ProductPagination
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db.models import Prefetch
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.decorators import action, permission_classes
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.filters import OrderingFilter
 from rest_framework.mixins import CreateModelMixin, DestroyModelMixin, RetrieveModelMixin, UpdateModelMixin
 from rest_framework.permissions import AllowAny, DjangoModelPermissions, DjangoModelPermissionsOrAnonReadOnly, IsAdminUser, IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
+from rest_framework.settings import api_settings
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
 from rest_framework import status
-from .filters import ProductFilter
-from .models import Cart, CartItem, Collection, Customer, Order, OrderItem, Product, ProductImage, Review
-from .serializers import AddCartItemSerializer, CartItemSerializer, CartSerializer, CollectionSerializer, CreateOrderSerializer, CustomerSerializer, OrderSerializer, ProductImageSerializer, ProductSerializer, ReviewSerializer, UpdateCartItemSerializer, UpdateOrderSerializer
-
-
-class ProductViewSet(ModelViewSet):
-    queryset = Product.objects.prefetch_related("images").all()
+from uuid import UUID
+from .carts import DatabaseCartStore, get_cart_store, get_cart_version
+from .customers import get_customer_id
+from .exports import EXPORT_FORMATS, PassthroughRenderer, iter_products
+from .facets import FacetMixin
+from .idempotency import idempotent
+from .imports import IMPORT_PARSERS, ProductImporter
+from .fieldsets import SparseFieldsetMixin, requested_fields
+from .filters import OrderFilter, ProductFilter, ProductSearchFilter
+from .orders import EmptyCart
+from .rollups import sales
+from .rows import CollectionRowPlan, ProductRowPlan, RowPlanListMixin
+from .models import Cart, CartItem, Collection, Customer, CustomerStats, Order, OrderItem, OrderRequest, OutOfStock, Product, ProductImage, Review
+from .serializers import AddCartItemSerializer, CartBatchSerializer, CartItemSerializer, CartSerializer, CartSummarySerializer, CollectionSerializer, CreateOrderSerializer, CustomerSerializer, CustomerStatsSerializer, OrderRequestSerializer, OrderSerializer, ProductImageSerializer, ProductSerializer, ReviewSerializer, SalesQuerySerializer, UpdateCartItemSerializer, UpdateOrderSerializer
+
+
+class ProductViewSet(ConditionalGetMixin, CachedResponseMixin, FacetMixin, RowPlanListMixin, SparseFieldsetMixin, ModelViewSet):
+    queryset = Product.objects.all()
     serializer_class = ProductSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    row_plan_class = ProductRowPlan
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter, OrderingFilter]
     filterset_class = ProductFilter
-    pagination_class = DefaultPagination
+    pagination_class = ProductPagination
     permission_classes = [IsAdminOrReadOnly]
     search_fields = ['title', 'description']
-    ordering_fields = ['unit_price', 'last_update']
+    ordering_fields = ['unit_price', 'last_update', 'effective_price']
+    cache_prefix = 'products'
+    cache_dependencies = [PROMOTIONS_SCOPE]
+    cache_query_params = [*ProductFilter.base_filters, 'search', 'ordering', 'page', 'cursor', 'count', 'fields', 'expand', 'facets']
+    sparse_columns = {
+        'title': ['title'],
+        'description': ['description'],
+        'slug': ['slug'],
+        'inventory': ['inventory'],
+        'unit_price': ['unit_price'],
+        'price_with_tax': ['unit_price'],
+        'collection': ['collection'],
+    }
+    sparse_prefetches = {'images': ['images']}
+    sparse_expansions = {'collection': 'collection'}
+    bulk_content_types = {
+        'application/x-ndjson': 'ndjson',
+        'text/csv': 'csv',
+    }
+
+    def get_queryset(self):
+        queryset = self.plan_queryset(super().get_queryset())
+        if self.uses_effective_price():
+            queryset = queryset.with_effective_price()
+        return queryset
+
+    def uses_effective_price(self):
+        fields = requested_fields(self.request)
+        if fields is None or fields & {'effective_price', 'effective_price_with_tax'}:
+            return True
+        query_params = self.request.query_params
+        return any(name.startswith('effective_price') for name in query_params) \
+            or 'effective_price' in query_params.get(api_settings.ORDERING_PARAM, '')
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        self.reload_effective_price(serializer)
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        self.reload_effective_price(serializer)
+
+    def reload_effective_price(self, serializer):
+        # The annotated prices are computed when the row is read, so a
+        # saved instance still carries the ones from before the save.
+        if self.uses_effective_price():
+            serializer.instance = self.get_queryset().get(pk=serializer.instance.pk)
+
+    def get_cache_scope(self):
+        collection_id = self.request.query_params.get('collection_id')
+        if self.action == 'list' and collection_id:
+            return collection_scope(collection_id)
+        return PRODUCTS_SCOPE
 
     def get_serializer_context(self):
         return {'request': self.request}
 
+    @action(detail=False, permission_classes=[IsAdminUser], renderer_classes=[JSONRenderer, PassthroughRenderer])
+    def export(self, request):
+        output = request.query_params.get('output', 'ndjson')
+        if output not in EXPORT_FORMATS:
+            return Response({'error': f'Export output must be one of: {", ".join(EXPORT_FORMATS)}.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        render_lines, content_type = EXPORT_FORMATS[output]
+        response = StreamingHttpResponse(
+            render_lines(iter_products(request=request)), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="products.{output}"'
+        return response
+
+    @action(detail=False, methods=['POST'], permission_classes=[IsAdminUser])
+    def bulk(self, request):
+        content_type = request.content_type.split(';')[0].strip()
+        if content_type == 'application/json':
+            rows = request.data
+            if not isinstance(rows, list):
+                return Response({'error': 'Expected a list of products.'}, status=status.HTTP_400_BAD_REQUEST)
+        elif content_type in self.bulk_content_types:
+            parse = IMPORT_PARSERS[self.bulk_content_types[content_type]]
+            try:
+                body = request.body.decode('utf-8')
+            except UnicodeDecodeError:
+                return Response({'error': 'The request body is not valid UTF-8.'}, status=status.HTTP_400_BAD_REQUEST)
+            rows = parse(body.splitlines())
+        else:
+            return Response({'error': f'Unsupported content type "{content_type}".'}, status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+        return Response(ProductImporter().run(rows))
+
     def destroy(self, request, *args, **kwargs):
         if OrderItem.objects.filter(product_id=kwargs['pk']).count() > 0:
             return Response({'error': 'Product cannot be deleted because it is associated with an order item.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
@@ -35,11 +138,12 @@ class ProductViewSet(ModelViewSet):
         return super().destroy(request, *args, **kwargs)
 
 
-class CollectionViewSet(ModelViewSet):
-    queryset = Collection.objects.annotate(
-        products_count=Count('products')).all()
+class CollectionViewSet(ConditionalGetMixin, RowPlanListMixin, ModelViewSet):
+    queryset = Collection.objects.all()
     serializer_class = CollectionSerializer
+    row_plan_class = CollectionRowPlan
     permission_classes = [IsAdminOrReadOnly]
+    cache_scope = COLLECTIONS_SCOPE
 
     def destroy(self, request, *args, **kwargs):
         if Product.objects.filter(collection_id=kwargs['pk']):
@@ -48,8 +152,13 @@ class CollectionViewSet(ModelViewSet):
         return super().destroy(request, *args, **kwargs)
 
 
-class ReviewViewSet(ModelViewSet):
+class ReviewViewSet(ConditionalGetMixin, ModelViewSet):
     serializer_class = ReviewSerializer
+    pagination_class = KeysetPagination
+    cache_query_params = ['cursor', 'count']
+
+    def get_cache_scope(self):
+        return reviews_scope(self.kwargs['product_pk'])
 
     def get_queryset(self):
         return Review.objects.filter(product_id=self.kwargs['product_pk'])
@@ -61,9 +170,51 @@ class ReviewViewSet(ModelViewSet):
 class CartViewSet(CreateModelMixin,
                   RetrieveModelMixin,
                   DestroyModelMixin,
+                  SparseFieldsetMixin,
                   GenericViewSet):
-    queryset = Cart.objects.prefetch_related('items__product').all()
+    queryset = Cart.objects.all()
     serializer_class = CartSerializer
+    sparse_prefetches = {
+        'items': [Prefetch('items', queryset=DatabaseCartStore().items_queryset())],
+    }
+
+    def get_queryset(self):
+        queryset = self.plan_queryset(super().get_queryset())
+        fields = requested_fields(self.request)
+        if self.action == 'retrieve' and (fields is None or 'total_price' in fields):
+            queryset = queryset.with_totals()
+        return queryset
+
+    def get_object(self):
+        if self.action != 'retrieve':
+            return super().get_object()
+        try:
+            cart = get_cart_store().get_cart(self.kwargs['pk'], self.get_queryset())
+        except (TypeError, ValueError, ValidationError):
+            cart = None
+        if cart is None:
+            raise Http404
+        self.check_object_permissions(self.request, cart)
+        return cart
+
+    def perform_destroy(self, instance):
+        get_cart_store().delete_cart(instance.pk)
+
+    @action(detail=True)
+    def summary(self, request, pk):
+        try:
+            cart_id = UUID(pk)
+        except ValueError:
+            raise Http404
+        key = f'store:cart-summary:{cart_id}:{get_cart_version(cart_id)}:{get_version(PRODUCTS_SCOPE)}'
+        data = cache.get(key)
+        if data is None:
+            summary = get_cart_store().get_summary(cart_id)
+            if summary is None:
+                raise Http404
+            data = CartSummarySerializer(summary).data
+            cache.set(key, data, settings.CART_CACHE_TIMEOUT)
+        return Response(data)
 
 
 class CartItemViewSet(ModelViewSet):
@@ -79,49 +230,140 @@ class CartItemViewSet(ModelViewSet):
     def get_serializer_context(self):
         return {'cart_id': self.kwargs['cart_pk']}
 
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
     def get_queryset(self):
         return CartItem.objects \
             .filter(cart_id=self.kwargs['cart_pk']) \
             .select_related('product')
 
+    def get_object(self):
+        try:
+            item = get_cart_store().get_item(self.kwargs['cart_pk'], int(self.kwargs['pk']))
+        except (TypeError, ValueError, ValidationError):
+            item = None
+        if item is None:
+            raise Http404
+        self.check_object_permissions(self.request, item)
+        return item
+
+    def list(self, request, *args, **kwargs):
+        items = get_cart_store().get_items(self.kwargs['cart_pk'])
+        serializer = self.get_serializer(items, many=True)
+        return Response(serializer.data)
+
+    def perform_destroy(self, instance):
+        get_cart_store().remove_item(instance.cart_id, instance.id)
+
+    @action(detail=False, methods=['POST'])
+    def batch(self, request, cart_pk):
+        serializer = CartBatchSerializer(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        cart = get_cart_store().get_cart(cart_pk)
+        return Response(CartSerializer(cart).data)
+
 
-class CustomerViewSet(ModelViewSet):
+class CustomerViewSet(SparseFieldsetMixin, ModelViewSet):
     queryset = Customer.objects.all()
     serializer_class = CustomerSerializer
     permission_classes = [IsAdminUser]
+    sparse_columns = {
+        'user_id': ['user'],
+        'phone': ['phone'],
+        'birth_date': ['birth_date'],
+        'membership': ['membership'],
+    }
+    sparse_expansions = {'user': 'user'}
+
+    def get_queryset(self):
+        return self.plan_queryset(super().get_queryset())
 
     @action(detail=True, permission_classes=[ViewCustomerHistoryPermission])
     def history(self, request, pk):
-        return Response('ok')
+        try:
+            customer_id = int(pk)
+        except ValueError:
+            raise Http404
+        stats = CustomerStats.objects \
+            .select_related('favourite_collection') \
+            .filter(customer_id=customer_id) \
+            .first()
+        if stats is None:
+            # Customers who never ordered have no stats row.
+            get_object_or_404(Customer, pk=customer_id)
+            stats = CustomerStats(customer_id=customer_id)
+
+        orders = Order.objects \
+            .filter(customer_id=customer_id) \
+            .prefetch_related(*OrderViewSet.sparse_prefetches['items'])
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(orders, request, self)
+        recent_orders = paginator.get_paginated_response(
+            OrderSerializer(page, many=True, context=self.get_serializer_context()).data)
+        return Response({**CustomerStatsSerializer(stats).data, 'recent_orders': recent_orders.data})
 
     @action(detail=False, methods=['GET', 'PUT'], permission_classes=[IsAuthenticated])
     def me(self, request):
-        customer = Customer.objects.get(
-            user_id=request.user.id)
+        customer = self.plan_queryset(Customer.objects).get(
+            pk=get_customer_id(request))
         if request.method == 'GET':
-            serializer = CustomerSerializer(customer)
+            serializer = CustomerSerializer(customer, context=self.get_serializer_context())
             return Response(serializer.data)
         elif request.method == 'PUT':
-            serializer = CustomerSerializer(customer, data=request.data)
+            serializer = CustomerSerializer(customer, data=request.data, context=self.get_serializer_context())
             serializer.is_valid(raise_exception=True)
             serializer.save()
             return Response(serializer.data)
 
 
-class OrderViewSet(ModelViewSet):
+class OrderViewSet(SparseFieldsetMixin, ModelViewSet):
     http_method_names = ['get', 'post', 'patch', 'delete', 'head', 'options']
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = OrderFilter
+    pagination_class = KeysetPagination
+    sparse_columns = {
+        'customer': ['customer'],
+        'placed_at': ['placed_at'],
+        'payment_status': ['payment_status'],
+    }
+    # Items with their products in one query and all their images in another.
+    sparse_prefetches = {'items': [
+        Prefetch('items', queryset=OrderItem.objects.select_related('product')),
+        'items__product__images',
+    ]}
+    sparse_expansions = {'customer': 'customer'}
 
     def get_permissions(self):
         if self.request.method in ['PATCH', 'DELETE']:
             return [IsAdminUser()]
         return [IsAuthenticated()]
 
+    @idempotent
     def create(self, request, *args, **kwargs):
         serializer = CreateOrderSerializer(
             data=request.data,
-            context={'user_id': self.request.user.id})
+            context={'customer_id': get_customer_id(request)})
         serializer.is_valid(raise_exception=True)
-        order = serializer.save()
+
+        if 'respond-async' in [token.strip() for token in request.headers.get('Prefer', '').split(',')]:
+            order_request = serializer.queue()
+            location = reverse('order-requests-detail', args=[order_request.id], request=request)
+            return Response(
+                OrderRequestSerializer(order_request).data,
+                status=status.HTTP_202_ACCEPTED,
+                headers={'Location': location, 'Preference-Applied': 'respond-async'})
+
+        try:
+            order = serializer.save()
+        except OutOfStock as error:
+            return Response({'items': [
+                {**failure, 'detail': 'Not enough items in stock.'} for failure in error.failures
+            ]}, status=status.HTTP_400_BAD_REQUEST)
+        except EmptyCart:
+            return Response({'cart_id': ['The cart is empty.']}, status=status.HTTP_400_BAD_REQUEST)
         serializer = OrderSerializer(order)
         return Response(serializer.data)
 
@@ -136,11 +378,33 @@ class OrderViewSet(ModelViewSet):
         user = self.request.user
 
         if user.is_staff:
-            return Order.objects.all()
+            return self.plan_queryset(Order.objects.all())
+
+        return self.plan_queryset(Order.objects.filter(customer_id=get_customer_id(self.request)))
+
+
+class OrderRequestViewSet(RetrieveModelMixin, GenericViewSet):
+    serializer_class = OrderRequestSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        user = self.request.user
+        if user.is_staff:
+            return OrderRequest.objects.all()
+        return OrderRequest.objects.filter(customer_id=get_customer_id(self.request))
+
+
+class SalesAnalyticsViewSet(GenericViewSet):
+    """
+    Revenue over a date range, read from the sales rollups rather than the
+    order tables.
+    """
+    permission_classes = [IsAdminUser]
 
-        customer_id = Customer.objects.only(
-            'id').get(user_id=user.id)
-        return Order.objects.filter(customer_id=customer_id)
+    def list(self, request):
+        query = SalesQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        return Response({**query.data, 'results': list(sales(**query.validated_data))})
 
 
 class ProductImageViewSet(ModelViewSet):
@@ -60,6 +60,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'store.customers.CustomerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -167,12 +168,14 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'COERCE_DECIMAL_TO_STRING': False,
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'core.authentication.CachedJWTAuthentication',
     ),
 }
 
 AUTH_USER_MODEL = 'core.User'
 
+AUTHENTICATION_BACKENDS = ['core.backends.CachedModelBackend']
+
 DJOSER = {
     'SERIALIZERS': {
         'user_create': 'core.serializers.UserCreateSerializer',
@@ -182,7 +185,8 @@ DJOSER = {
 
 SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('JWT',),
-    'ACCESS_TOKEN_LIFETIME': timedelta(days=1)
+    'ACCESS_TOKEN_LIFETIME': timedelta(days=1),
+    'TOKEN_OBTAIN_SERIALIZER': 'core.serializers.TokenObtainPairSerializer',
 }
 
 
@@ -201,6 +205,51 @@ DEBUG_TOOLBAR_CONFIG = {
     'SHOW_TOOLBAR_CALLBACK': lambda request: True
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': 'redis://redis:6379/2',
+        'TIMEOUT': 10 * 60,
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+        }
+    }
+}
+
+PRODUCT_CACHE_TIMEOUT = 10 * 60
+
+USER_CACHE_TIMEOUT = 5 * 60
+
+PAGINATION_COUNT_TIMEOUT = 5 * 60
+
+# None picks MySQL FULLTEXT on MySQL and the in-process index elsewhere.
+SEARCH_BACKEND = None
+
+# store.carts.CachedCartStore keeps active carts in the cache and writes
+# them back CART_FLUSH_DELAY seconds after a change.
+CART_STORE = 'store.carts.DatabaseCartStore'
+CART_CACHE_TIMEOUT = 24 * 60 * 60
+CART_FLUSH_DELAY = 30
+
+# Carts older than this are deleted by store.tasks.purge_expired_carts.
+CART_TTL = timedelta(days=30)
+CART_PURGE_CHUNK_SIZE = 1000
+
+# Order requests placed per worker transaction in async checkout.
+ORDER_REQUEST_BATCH_SIZE = 50
+
+# Responses to requests sent with an Idempotency-Key are replayed for
+# repeats within IDEMPOTENCY_TTL; a repeat of a request still running waits
+# up to IDEMPOTENCY_WAIT for it.
+IDEMPOTENCY_TTL = 24 * 60 * 60
+IDEMPOTENCY_WAIT = 10
+IDEMPOTENCY_LOCK_TIMEOUT = 60
+
+# Delivery of store.models.OutboxEvent by store.tasks.dispatch_outbox.
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_MAX_ATTEMPTS = 10
+OUTBOX_LEASE = 5 * 60
+
 CELERY_BROKER_URL = 'redis://redis:6379/1'
 CELERY_RESULT_BACKEND = 'redis://redis:6379/1'
 CELERY_ACCEPT_CONTENT = ['json']
@@ -214,4 +263,16 @@ CELERY_BEAT_SCHEDULE = {
         'schedule': 10.0,
         'args': ['Hello World']
     },
+    'dispatch-outbox': {
+        'task': 'store.tasks.dispatch_outbox',
+        'schedule': 60.0,
+    },
+    'process-order-requests': {
+        'task': 'store.tasks.process_order_requests',
+        'schedule': 60.0,
+    },
+    'purge-expired-carts': {
+        'task': 'store.tasks.purge_expired_carts',
+        'schedule': crontab(hour=3, minute=0),
+    },
 }
\ No newline at end of file